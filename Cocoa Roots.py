@@ -1,10 +1,34 @@
+import os
+import re
+import copy
+import gzip
+import uuid
+import html
+import json
 import pickle
+import hashlib
+import heapq
+import sys
+import tempfile
+import time
+import zlib
+import bisect
+import collections
+from array import array
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
 import tkinter as tk
 import tkinter.ttk as ttk
-from tkinter import messagebox
+from tkinter import messagebox, filedialog
 from PIL import Image, ImageTk
 from datetime import datetime
 
+try:
+    import numpy as np
+except ImportError:  # similar batch search needs numpy, the rest of the app runs without it
+    np = None
+
 # lists of classes and objects
 # these associative arrays are global
 ingredients = {}
@@ -12,6 +36,10 @@ batches = {}
 
 FILE_NAME = "data.pkl"
 
+# opt-in latency instrumentation, enabled by starting the app with --instrument
+INSTRUMENT = "--instrument" in sys.argv
+DIAGNOSTICS_FILE = "diagnostics.txt"
+
 # global colours
 BLACK = "#000000"  # string
 RED = "#B3152A"
@@ -29,16 +57,40 @@ ERROR_GREEN = "#46F274"  # This colour should only be on hidden elements
 # -----------------------------------------------------------------------------
 
 def save():
+    window.content.pages[EditBatchPage].finish_scans()  # scans made before closing are kept
+
+    rewritten = cold_archive.ids & batches.keys()  # archived batches written to, maybe archived again below
+    archive_finalised()  # move old finalised batches out of memory before pickling
+
     # condense data to one object to save
+    change_feed.poll()  # take in the other open windows' last changes so this save includes them
+    change_feed.rotate()
+
     file_data = {"ingredients": ingredients, "batches": batches,
-                 "batch_id_counter": Batch.id_counter, "ingredient_id_counter": Ingredient.id_counter}
+                 "batch_id_counter": Batch.id_counter, "ingredient_id_counter": Ingredient.id_counter,
+                 "sync": site_sync.state(), "ledger": merkle_ledger.state(), "feed_offset": change_feed.offset,
+                 "feed_inode": change_feed.inode}
 
     with open(FILE_NAME, "wb") as file:
         pickle.dump(file_data, file)  # save data to file
 
+    # archive files of batches brought back into memory are only removed once the data file holds them
+    for batch_id in cold_archive.ids & batches.keys():
+        cold_archive.remove(batch_id)
+
+    save_archive_indexes(rewritten)
+
     window.destroy()  # close window
 
 
+# called on closing the window, save is looked up here so its instrumented wrapper has recorded before the dump
+def close():
+    save()
+
+    if INSTRUMENT:
+        monitor.dump()  # keep a diagnostics file from every instrumented session, including the save timing
+
+
 def load():
     try:
         file = open(FILE_NAME, "rb")
@@ -47,10 +99,11 @@ def load():
     except FileNotFoundError:  # if file does not exist
 
         open(FILE_NAME, "wb")  # create file
+        change_feed.start(None)  # nothing saved yet, only changes made from now on are shared
         return -1  # finish load()
 
-    # if file content matches format
-    if list(content.keys()) == ["ingredients", "batches", "batch_id_counter", "ingredient_id_counter"]:
+    # if file content matches format, keys added by later versions are optional so older files still load
+    if all(key in content for key in ["ingredients", "batches", "batch_id_counter", "ingredient_id_counter"]):
 
         ingredients.update(content["ingredients"])
         batches.update(content["batches"])
@@ -58,6 +111,17 @@ def load():
         Batch.id_counter = content["batch_id_counter"]
         Ingredient.id_counter = content["ingredient_id_counter"]
 
+        # a batch both in the data file and the archive was saved back into memory (or by another window) after
+        # it was archived, the data file copy is kept
+        for batch_id in cold_archive.ids & batches.keys():
+            cold_archive.remove(batch_id)
+
+        if not restore_indexes():
+            rebuild_indexes()
+        site_sync.load_state(content.get("sync"))
+        merkle_ledger.load_state(content.get("ledger"))
+        change_feed.start(content.get("feed_offset"), content.get("feed_inode"))
+
     else:
         messagebox.showerror("Import Error", "There was an error loading content")
 
@@ -70,13 +134,21 @@ class Ingredient:
     id_counter = {}  # associative array counter, keys will be 3 character ingredient codes, key_values will be int
 
     # data comes from create_ingredient method of IngredientPage class, submitted by the user to the GUI
-    # name: str, weight: float, source: str
-    def __init__(self, name, weight, source):
-        code = name[:3].upper()
-        code_counter = Ingredient.id_counter.get(code, 1)
+    # name: str, weight: float, source: str, ingredient_id: str (only given for ingredients synced from another site)
+    def __init__(self, name, weight, source, ingredient_id=None):
+        if ingredient_id is None:
+            code = name[:3].upper()
 
-        self.id = f"ING-{code}-{code_counter:03d}"  # ingredient unique identifier
-        Ingredient.id_counter[code] = code_counter + 1
+            while True:  # another open window may have issued the same id since its last change feed poll
+                code_counter = Ingredient.id_counter.get(code, 1)
+
+                self.id = f"ING-{code}-{code_counter:03d}"  # ingredient unique identifier
+                Ingredient.id_counter[code] = code_counter + 1
+
+                if change_feed.claim(self.id):
+                    break
+        else:
+            self.id = ingredient_id
 
         self.name = name  # common name of batch
         self.weight = weight
@@ -100,18 +172,31 @@ class Ingredient:
             del ingredients[self.id]
 
 
+MAX_PROCESS_DAYS = 365  # longest fermentation or drying accepted, a longer range is a mistyped date
+
+
 class Batch:
     id_counter = 1  # int counter
 
-    def __init__(self):
+    # batch_id: str (only given for batches synced from another site)
+    def __init__(self, batch_id=None):
         self.__log = []  # list of every event occurred in batch
         self.__total_weight = 0  # batch data private
         self.__ingredients = {}
+        self.created = time.time()  # seconds since epoch, batches saved before this was recorded read as 0
 
-        self.id = f"BAT-{Batch.id_counter:03d}"  # Batch unique identifier
-        Batch.id_counter += 1
+        if batch_id is None:
+            while True:  # another open window may have issued the same id since its last change feed poll
+                self.id = f"BAT-{Batch.id_counter:03d}"  # Batch unique identifier
+                Batch.id_counter += 1
 
-        messagebox.showinfo("Notification", f"New Batch Created, id: {self.id}")
+                if change_feed.claim(self.id):
+                    break
+
+            if index_buffer is None:  # a transaction may still be rolled back, it reports new batches on commit
+                messagebox.showinfo("Notification", f"New Batch Created, id: {self.id}")
+        else:
+            self.id = batch_id
 
     # __________ Batch Methods __________
     # the data for these methods comes from alter_batch method from EditBatchPage class
@@ -168,7 +253,7 @@ class Batch:
                   "date": date.strftime("%d/%m/%Y")
                   }
 
-        self.__log.append(record)
+        self.__add_record(record)
 
     # start_dt: datetime, end_dt: datetime, additive: str,
     # amount: float (amount is float for more precise measurement than int)
@@ -186,6 +271,11 @@ class Batch:
             messagebox.showerror("Type Error", "Date must be inputted in the format DD/MM/YYYY")
             return -1
 
+        if not 0 <= (end_dt - start_dt).days <= MAX_PROCESS_DAYS:  # range check
+            messagebox.showerror("Range Error", f"End date must be on or up to {MAX_PROCESS_DAYS} days after the "
+                                                f"start date")
+            return -1
+
         try:
             amount = float(amount)
 
@@ -210,7 +300,7 @@ class Batch:
                   "duration": duration.days
                   }
 
-        self.__log.append(record)
+        self.__add_record(record)
 
     # start_dt: datetime, end_dt: datetime, additive: str,
     # temperature: float (temperature is float for more precise measurement than int)
@@ -228,6 +318,11 @@ class Batch:
             messagebox.showerror("Type Error", "Date must be inputted in the format DD/MM/YYYY")
             return -1
 
+        if not 0 <= (end_dt - start_dt).days <= MAX_PROCESS_DAYS:  # range check
+            messagebox.showerror("Range Error", f"End date must be on or up to {MAX_PROCESS_DAYS} days after the "
+                                                f"start date")
+            return -1
+
         try:
             temperature = float(temperature)
 
@@ -244,7 +339,7 @@ class Batch:
                   "duration": duration.days
                   }
 
-        self.__log.append(record)
+        self.__add_record(record)
 
     # date: datetime, weight_reduced: float
     def winnowing(self, date, weight_reduced):
@@ -260,6 +355,13 @@ class Batch:
             messagebox.showerror("Type Error", "Date must be inputted in the format DD/MM/YYYY")
             return -1
 
+        try:
+            weight_reduced = float(weight_reduced)
+
+        except ValueError:
+            messagebox.showerror("Type Error", "Weight reduced must be an floating point")
+            return -1
+
         if weight_reduced > self.__total_weight:  # range check
             messagebox.showerror("Range Error", "Weight reduced cannot be greater than total weight")
             return -1
@@ -269,7 +371,7 @@ class Batch:
                   "date": date.strftime("%d/%m/%Y"),
                   }
 
-        self.__log.append(record)
+        self.__add_record(record)
 
     # date: datetime, fineness: float
     def grinding(self, date, fineness):  # fineness in mm
@@ -285,6 +387,13 @@ class Batch:
             messagebox.showerror("Type Error", "Date must be inputted in the format DD/MM/YYYY")
             return -1
 
+        try:
+            fineness = float(fineness)
+
+        except ValueError:
+            messagebox.showerror("Type Error", "Fineness must be an floating point")
+            return -1
+
         if fineness < 0:  # range check
             messagebox.showerror("Range Error", "Fineness cannot be less than zero")
             return -1
@@ -294,7 +403,7 @@ class Batch:
                   "date": date.strftime("%d/%m/%Y"),
                   }
 
-        self.__log.append(record)
+        self.__add_record(record)
 
     # date: datetime, temperature: float
     def conching(self, date, temperature):
@@ -322,13 +431,16 @@ class Batch:
                   "date": date.strftime("%d/%m/%Y"),
                   }
 
-        self.__log.append(record)
+        self.__add_record(record)
 
     # date: datetime, melting_temp: float, cooling_temp: float, working_temp: float, molding_dimension: str (string
-    # used as molding dimensions include multiple numeric values and other shape descriptions), weight_per_bar: float
-    def tempering_molding(self, date, melting_temp, cooling_temp, working_temp, molding_dimension, weight_per_bar):
+    # used as molding dimensions include multiple numeric values and other shape descriptions), weight_per_bar: float,
+    # bar_count: int (weight_per_bar is in the same unit as ingredient amounts so output can be balanced with input)
+    def tempering_molding(self, date, melting_temp, cooling_temp, working_temp, molding_dimension, weight_per_bar,
+                          bar_count):
 
-        if not (date and melting_temp and cooling_temp and working_temp and molding_dimension and weight_per_bar):
+        if not (date and melting_temp and cooling_temp and working_temp and molding_dimension and weight_per_bar
+                and bar_count):
             messagebox.showerror("Existence Error", "Please complete all fields")
             return -1
 
@@ -353,16 +465,28 @@ class Batch:
             messagebox.showerror("Range Error", "Weight per bar cannot be less than zero")
             return -1
 
+        try:
+            bar_count = int(bar_count)
+
+        except ValueError:
+            messagebox.showerror("Type Error", "Bar count must be a whole number")
+            return -1
+
+        if bar_count < 0:  # range check
+            messagebox.showerror("Range Error", "Bar count cannot be less than zero")
+            return -1
+
         record = {"process": "tempering_molding",
                   "melting_temp": melting_temp,
                   "cooling_temp": cooling_temp,
                   "working_temp": working_temp,
                   "molding_dimension": molding_dimension,
                   "weight_per_bar": weight_per_bar,
+                  "bar_count": bar_count,
                   "date": date.strftime("%d/%m/%Y"),
                   }
 
-        self.__log.append(record)
+        self.__add_record(record)
 
     # date: datetime, verification_num: str (str used for verification_num as it does not need to
     # undergo numeric operations and may contain non-numeric characters)
@@ -381,244 +505,3107 @@ class Batch:
 
         record = {"process": "finalise",
                   "verification_num": verification_num,
+                  "merkle_root": merkle_root(log_hashes(self.__log)),  # commits to the log
                   "date": date.strftime("%d/%m/%Y"),
                   }
 
-        self.__log.append(record)
+        self.__add_record(record)
 
-    # log getter
-    def get_log(self):
-        return self.__log
+    # date: str, weight: float, moves weight into a new child batch (e.g. one conche into several molding runs)
+    def split(self, date, weight):
 
+        if not (date and weight):
+            messagebox.showerror("Existence Error", "Please complete all fields")
+            return -1
 
-# -----------------------------------------------------------------------------
-# GUI INTERFACE
-# -----------------------------------------------------------------------------
+        try:
+            date = datetime.strptime(date, "%d/%m/%Y")
 
-class Window(tk.Tk):
-    def __init__(self, *args, **kwargs):
-        tk.Tk.__init__(self, *args, **kwargs)
+        except ValueError:
+            messagebox.showerror("Type Error", "Date must be inputted in the format DD/MM/YYYY")
+            return -1
 
-        self.logo = ImageTk.PhotoImage(Image.open("Resources/Bean_Logo.png"))
+        try:
+            weight = float(weight)
 
-        # adjust window features
-        self.config(bg="blue")
-        self.geometry("400x600")  # window dimensions
-        self.title("Cocoa Roots")
-        self.grid_columnconfigure(1, weight=1)  # make expandable with screen
-        self.grid_rowconfigure(2, weight=1)
+        except ValueError:
+            messagebox.showerror("Type Error", "Weight must be an floating point")
+            return -1
 
-        style = ttk.Style()  # set ttk style (to format scroll bars)
-        style.theme_use("clam")
+        if not 0 < weight <= self.__total_weight:  # range check
+            messagebox.showerror("Range Error", "Weight must be more than zero and no more than the batch weight")
+            return -1
 
-        # titlebar
-        self.title_bar = tk.Frame(height=4, bg=ORANGE)
-        self.title_bar.grid(row=1, column=1, sticky="ew")
+        child = Batch()
+        batches[child.id] = child
+        index_batch(child)
 
-        logo_label = tk.Label(self.title_bar, image=self.logo, bg=ORANGE)
-        logo_label.pack(side=tk.LEFT)
+        self.__total_weight -= weight
+        child.__total_weight += weight
 
-        title_text = tk.Label(self.title_bar, text="Cocoa Roots", font=("Bernard MT Condensed", 25), bg=ORANGE)
-        title_text.pack(side=tk.LEFT)
+        self.__add_record({"process": "split",
+                           "child": child.id,
+                           "amount": weight,
+                           "date": date.strftime("%d/%m/%Y"),
+                           })
 
-        # Put content below titlebar
-        content = Content(self)
-        content.grid(row=2, column=1, sticky="nsew")
+        child.__add_record({"process": "split_from",
+                            "parent": self.id,
+                            "amount": weight,
+                            "date": date.strftime("%d/%m/%Y"),
+                            })
 
+    # date: str, batch_id: str, weight: float, adds weight taken from another batch (e.g. leftover liquor)
+    def merge(self, date, batch_id, weight):
 
-class Content(tk.Frame):
-    def __init__(self, parent):
-        tk.Frame.__init__(self, bg=BACKGROUND, height=20, borderwidth=1, relief="solid")
-        self.grid_rowconfigure(1, weight=1)
-        self.grid_columnconfigure(1, weight=1)
+        if not (date and batch_id and weight):
+            messagebox.showerror("Existence Error", "Please complete all fields")
+            return -1
 
-        self.back_track = {}  # keep track of page navigation
-        # place button in titlebar
-        self.back_button = tk.Button(parent.title_bar,
-                                     text="<",
-                                     width=7,
-                                     height=2,
-                                     bg=LIGHT_ORANGE,
-                                     borderwidth=1,
-                                     relief="solid",
-                                     command=lambda: self.go_back()
-                                     )
+        try:
+            date = datetime.strptime(date, "%d/%m/%Y")
 
-        self.pages = {}  # dictionary of sub-frames within content
+        except ValueError:
+            messagebox.showerror("Type Error", "Date must be inputted in the format DD/MM/YYYY")
+            return -1
 
-        # use of for loop control structure to minimise repetition in code
-        for page in [UserPage, WorkerPage, ConsumerPage, IngredientPage,
-                     EditBatchPage, ViewBatchPage]:  # for every page within content
-            page_class = page(parent=self)  # create frame class
+        try:
+            weight = float(weight)
 
-            self.pages[page] = page_class
+        except ValueError:
+            messagebox.showerror("Type Error", "Weight must be an floating point")
+            return -1
 
-            page_class.grid(row=1, column=1, sticky="nsew")
+        batch_id = batch_id.upper()
 
-        self.current_page = UserPage
-        self.switch_page(UserPage)
+        if batch_id not in batches or batch_id == self.id:
+            messagebox.showinfo("Not Found", "Batch id was not found, please check id is in format BAT-000")
+            return -1
 
-    def navigate(self, page_name):  # user navigation that records previous page
-        self.back_track[page_name] = self.current_page
-        self.switch_page(page_name)
+        source = batches[batch_id]
 
-    def go_back(self):  # switches to previous page
-        last_page = self.back_track[self.current_page]
-        self.switch_page(last_page)
+        if not 0 < weight <= source.__total_weight:  # range check
+            messagebox.showerror("Range Error", "Weight must be more than zero and no more than the source weight")
+            return -1
 
-    def switch_page(self, page_name):
-        if page_name in self.back_track:  # if there is a page before current
-            self.back_button.pack(padx=10, side=tk.RIGHT)  # show back button
-        else:
-            self.back_button.pack_forget()  # hide back button
+        source.__total_weight -= weight
+        self.__total_weight += weight
 
-        self.current_page = page_name
-        page = self.pages[page_name]
-        page.tkraise()  # bring frame to front (switch page)
+        source.__add_record({"process": "merged_into",
+                             "child": self.id,
+                             "amount": weight,
+                             "date": date.strftime("%d/%m/%Y"),
+                             })
 
+        self.__add_record({"process": "merge",
+                           "parent": source.id,
+                           "amount": weight,
+                           "date": date.strftime("%d/%m/%Y"),
+                           })
 
-class UserPage(tk.Frame):  # menu to select user type
-    def __init__(self, parent):
-        tk.Frame.__init__(self, parent, bg=BACKGROUND, height=20, borderwidth=1, relief="solid")
-        self.grid_rowconfigure(1, weight=1)
-        self.grid_rowconfigure(2, weight=1)
-        self.grid_columnconfigure(1, weight=1)
+    # date: str DD/MM/YYYY, amount: float already range checked by the rapid entry bar
+    # returns -1 without a prompt if the stock no longer covers amount, so a failed scan is listed, not shown
+    def add_scanned(self, date, ingredient_id, amount):
+        ingredient = ingredients.get(ingredient_id)
 
-        worker_button = tk.Button(self,
-                                  text="Worker",
-                                  bg=LIGHT_BLUE,
-                                  height=7,
-                                  width=30,
-                                  borderwidth=1,
-                                  relief="solid",
-                                  command=lambda: parent.navigate(WorkerPage)
-                                  )
-        worker_button.grid(row=1, column=1)
+        if ingredient is None or ingredient.weight < amount:
+            return -1
 
-        consumer_button = tk.Button(self,
-                                    text="Consumer",
-                                    bg=LIGHT_BLUE,
-                                    height=7,
-                                    width=30,
-                                    borderwidth=1,
-                                    relief="solid",
-                                    command=lambda: parent.navigate(ConsumerPage)
-                                    )
-        consumer_button.grid(row=2, column=1)
+        if ingredient.weight == amount:
+            del ingredients[ingredient_id]
+        else:
+            ingredient.weight -= amount
 
+        self.import_record({"process": "add_ingredient",
+                            "ingredient": ingredient_id,
+                            "amount": amount,
+                            "date": date,
+                            })
 
-class WorkerPage(tk.Frame):
-    def __init__(self, parent):
-        tk.Frame.__init__(self, parent, height=20, borderwidth=1, relief="solid")
+    # log getter
+    def get_log(self):
+        return self.__log
 
-        self.batch_id = ""
-        self.parent = parent
+    # record: dict already validated at the site that created it, applied without prompts (used by sync)
+    def import_record(self, record):
+        process = record["process"]
 
-        self.grid_rowconfigure(1, weight=1)
-        self.grid_rowconfigure(2, weight=1)
-        self.grid_rowconfigure(3, weight=2)
+        if process in WEIGHT_IN:
+            self.__total_weight += record["amount"]
+        elif process in WEIGHT_OUT:
+            self.__total_weight -= record["amount"]
 
-        self.grid_columnconfigure(1, weight=1)
+        if process in ["add_ingredient", "fermentation"]:
+            self.__ingredients[record["ingredient"]] = self.__ingredients.get(record["ingredient"], 0) + record["amount"]
 
-        # __________ Ingredient Frame __________
-        ingredient_frame = tk.Frame(self,
-                                    bg=LIGHT_BLUE,
-                                    height=50,
-                                    width=50,
-                                    borderwidth=1,
-                                    relief="solid"
-                                    )
-        ingredient_frame.grid(row=1, column=1, padx=15, sticky="we")
+        self.__add_record(record)
 
-        ingredient_frame.grid_propagate(False)  # keep specified dimensions
-        ingredient_frame.rowconfigure(1, weight=1)
-        ingredient_frame.columnconfigure(1, weight=1)
+    # every event goes through here so the indexes see it as it is appended
+    def __add_record(self, record):
+        self.__log.append(record)
+        index_event(self, record)
 
-        ingredient_label = tk.Label(ingredient_frame,
-                                    bg=LIGHT_BLUE,
-                                    text="Add Ingredient"
-                                    )
-        ingredient_label.grid(row=1, column=1, sticky="w", padx=5)
 
-        ingredient_button = tk.Button(ingredient_frame,
-                                      bg=LIGHT_ORANGE,
-                                      text="+",
-                                      font=("Calabi", 12),
-                                      padx=5,
-                                      command=lambda: parent.navigate(IngredientPage)
-                                      )
-        ingredient_button.grid(row=1, column=2, sticky="e", padx=5)
+# Batch attributes that are not processes, kept off the edit page forms and process lists
+NON_PROCESS_ATTRIBUTES = ["id_counter", "get_log", "import_record", "add_scanned"]
 
-        # __________ Batches Frame __________
-        batches_frame = tk.Frame(self,
-                                 bg=LIGHT_BLUE,
-                                 height=50,
-                                 width=50,
-                                 borderwidth=1,
-                                 relief="solid"
-                                 )
-        batches_frame.grid(row=2, column=1, padx=15, sticky="nwe")
 
-        batches_frame.grid_propagate(False)  # keep specified dimensions
-        batches_frame.rowconfigure(1, weight=1)
-        batches_frame.columnconfigure(1, weight=1)
+# -----------------------------------------------------------------------------
+# INDEXES
+# -----------------------------------------------------------------------------
+# derived views of the batch logs, updated as each event is appended and rebuilt from the logs after load()
 
-        batches_label = tk.Label(batches_frame,
-                                 bg=LIGHT_BLUE,
-                                 text="Add Batch"
-                                 )
-        batches_label.grid(row=1, column=1, sticky="w", padx=5)
+class BatchIndex:  # base class, indexes override the hooks they need
+    derived = True  # derived indexes are cleared and replayed from the logs by rebuild_indexes()
+    unsaved = ()  # attributes of a derived index that do not come from the logs, left out of INDEX_STATE_FILE
 
-        batches_button = tk.Button(batches_frame,
-                                   bg=LIGHT_ORANGE,
-                                   text="+",
-                                   font=("Calabi", 12),
-                                   padx=5,
-                                   command=lambda: self.add_batch()
-                                   )
-        batches_button.grid(row=1, column=2, sticky="e", padx=5)
+    def reset(self):
+        pass
 
-        # __________ Existing Batches __________
+    def add_batch(self, batch):
+        pass
 
-        content_frame = tk.Frame(self, bg=BLACK)  # black frame to create boarder
-        content_frame.grid(row=3, column=1, sticky="nsew", pady=(0, 20), padx=10)
+    def add_event(self, batch, record):
+        pass
 
-        self.scroll_area = ScrollableBatchList(content_frame, parent, "worker")
-        self.scroll_area.pack(fill="both", expand=True, pady=3, padx=3)
+    def add_ingredient(self, ingredient, source):
+        pass
 
-    def add_batch(self):
-        instance = Batch()
-        instance_id = instance.id
+    def rebuilt(self):  # called once rebuild_indexes() has replayed every log
+        pass
 
-        batches[instance_id] = instance  # add batch instance to dictionary
-        self.scroll_area.update_batch_list()  # reload worker page batch list
-        self.parent.pages[ConsumerPage].scroll_area.update_batch_list()  # reload user page batch list
 
+indexes = []  # every registered index
+index_buffer = None  # list of (hook name, arguments) held back while a bulk operation is open
 
-class IngredientPage(tk.Frame):
-    def __init__(self, parent):
-        tk.Frame.__init__(self, parent, height=20, borderwidth=1, relief="solid")
-        self.grid_rowconfigure(1, weight=1)
-        self.grid_rowconfigure(2, weight=4)
 
-        self.grid_columnconfigure(1, weight=1)
+# hook: name of a BatchIndex method, run on every index unless a bulk operation is holding hooks back
+def run_hook(hook, *args):
+    if index_buffer is not None:
+        index_buffer.append((hook, args))
+        return
 
-        # __________ Page Title __________
-        title_frame = tk.Frame(self,
-                               bg=LIGHT_BLUE,
-                               height=50,
-                               width=50,
-                               borderwidth=1,
-                               relief="solid"
-                               )
-        title_frame.grid(row=1, column=1, padx=15, sticky="we")
+    for index in indexes:
+        getattr(index, hook)(*args)
 
-        title_frame.grid_propagate(False)
-        title_frame.rowconfigure(1, weight=1)
-        title_frame.columnconfigure(1, weight=1)
 
-        title_label = tk.Label(title_frame,
-                               bg=LIGHT_BLUE,
+def index_batch(batch):
+    run_hook("add_batch", batch)
+
+
+def index_event(batch, record):
+    run_hook("add_event", batch, record)
+
+
+# ingredient: Ingredient, source: str (ingredients are not replayed by rebuild_indexes, they have no log)
+def index_ingredient(ingredient, source):
+    run_hook("add_ingredient", ingredient, source)
+
+
+INDEX_STATE_VERSION = 4  # increase whenever a derived index changes what it keeps
+INDEX_STATE_FILE = "index_state.pkl"  # derived indexes over the archived batches alone, hot batches are replayed
+
+
+# batches: iterable of Batch, targets: derived indexes the batch logs are replayed into
+def replay_batches(batches_to_replay, targets):
+    for batch in batches_to_replay:
+        for index in targets:
+            index.add_batch(batch)
+
+        for record in batch.get_log():
+            for index in targets:
+                index.add_event(batch, record)
+
+
+# returns the state written by save_archive_indexes(), or None if there is none this version can use
+def read_index_state():
+    try:
+        with open(INDEX_STATE_FILE, "rb") as file:
+            state = pickle.load(file)
+
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+
+    if (state["version"] != INDEX_STATE_VERSION
+            or any(type(index).__name__ not in state["indexes"] for index in indexes if index.derived)):
+        return None
+
+    return state
+
+
+# the archive only changes when batches age into it or are written to again, so the derived indexes over it are
+# saved to their own file at those times rather than with the data. Newly archived batches are added to the saved
+# indexes, only a batch leaving the archive makes every archived batch be replayed again
+# rewritten: ids of archived batches brought back into memory to be written to since the state was saved
+def save_archive_indexes(rewritten):
+    archived = cold_archive.ids - batches.keys()
+    state = read_index_state()
+    grown = state is not None and set(state["archive"]) <= archived and not rewritten & set(state["archive"])
+
+    if grown and set(state["archive"]) == archived:
+        return
+
+    targets = {type(index).__name__: type(index)() for index in indexes if index.derived}
+
+    for name, index in targets.items():
+        index.reset()
+        if grown:
+            index.__dict__.update(state["indexes"][name])
+
+    added = archived - set(state["archive"]) if grown else archived
+    replay_batches((cold_archive.read(batch_id) for batch_id in sorted(added)), targets.values())
+
+    if not grown:
+        for index in targets.values():
+            index.rebuilt()
+
+    with open(INDEX_STATE_FILE + ".tmp", "wb") as file:
+        pickle.dump({"version": INDEX_STATE_VERSION, "archive": sorted(archived),
+                     "indexes": {name: {field: value for field, value in index.__dict__.items()
+                                        if field not in index.unsaved}
+                                 for name, index in targets.items()}}, file)
+
+    os.replace(INDEX_STATE_FILE + ".tmp", INDEX_STATE_FILE)  # a crash while writing keeps the previous state
+
+
+# returns False if there is no saved state for the current archive and the indexes must be rebuilt instead
+def restore_indexes():
+    derived = [index for index in indexes if index.derived]
+    state = read_index_state()
+
+    if state is None or set(state["archive"]) != cold_archive.ids - batches.keys():
+        return False
+
+    for index in derived:
+        index.reset()
+        index.__dict__.update(state["indexes"][type(index).__name__])
+
+    replay_batches(batches.values(), derived)
+    return True
+
+
+def rebuild_indexes():
+    derived = [index for index in indexes if index.derived]
+
+    for index in derived:
+        index.reset()
+
+    # archived batches are streamed from disk one at a time so the indexes still cover the whole history
+    replay_batches(chain(batches.values(), cold_archive.iter_batches(exclude=batches)), derived)
+
+    for index in derived:
+        index.rebuilt()
+
+
+# start: str, edges: dict of id: set of ids, returns every id reachable from start (not including start)
+def walk(start, edges):
+    found = set()
+    pending = [start]
+
+    while pending:
+        for next_id in edges.get(pending.pop(), ()):
+            if next_id not in found:
+                found.add(next_id)
+                pending.append(next_id)
+
+    return found
+
+
+class LineageIndex(BatchIndex):
+    # split and merge events link batches into a graph, transitive closures are cached per batch and only the
+    # entries a new edge can change are dropped, so queries cost the size of their answer
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.parents = {}  # batch id: set of batch ids it took material from
+        self.children = {}  # batch id: set of batch ids it gave material to
+        self.lots = {}  # batch id: set of ingredient ids added directly to it
+        self.upstream_cache = {}
+        self.downstream_cache = {}
+        self.lots_cache = {}
+
+    def add_event(self, batch, record):
+        if record["process"] == "add_ingredient":
+            self.lots.setdefault(batch.id, set()).add(record["ingredient"])
+
+            for batch_id in self.downstream(batch.id) | {batch.id}:  # every batch the new lot flows into
+                self.lots_cache.pop(batch_id, None)
+
+        elif "parent" in record:
+            self.add_edge(record["parent"], batch.id)
+
+        elif "child" in record:
+            self.add_edge(batch.id, record["child"])
+
+    def add_edge(self, parent_id, child_id):
+        if child_id in self.children.get(parent_id, ()):  # both sides of a split or merge record the edge
+            return
+
+        # caches that can change are the downstream of the parent's ancestors and the upstream of the child's
+        # descendants, found before the edge is added
+        for batch_id in self.upstream(parent_id) | {parent_id}:
+            self.downstream_cache.pop(batch_id, None)
+
+        for batch_id in self.downstream(child_id) | {child_id}:
+            self.upstream_cache.pop(batch_id, None)
+            self.lots_cache.pop(batch_id, None)
+
+        self.children.setdefault(parent_id, set()).add(child_id)
+        self.parents.setdefault(child_id, set()).add(parent_id)
+
+    # every batch that material in batch_id came from
+    def upstream(self, batch_id):
+        if batch_id not in self.upstream_cache:
+            self.upstream_cache[batch_id] = frozenset(walk(batch_id, self.parents))
+
+        return self.upstream_cache[batch_id]
+
+    # every batch that material from batch_id went into
+    def downstream(self, batch_id):
+        if batch_id not in self.downstream_cache:
+            self.downstream_cache[batch_id] = frozenset(walk(batch_id, self.children))
+
+        return self.downstream_cache[batch_id]
+
+    # every raw ingredient lot that ended up in batch_id
+    def ingredient_lots(self, batch_id):
+        if batch_id not in self.lots_cache:
+            lots = set(self.lots.get(batch_id, ()))
+            for upstream_id in self.upstream(batch_id):
+                lots |= self.lots.get(upstream_id, set())
+
+            self.lots_cache[batch_id] = frozenset(lots)
+
+        return self.lots_cache[batch_id]
+
+
+lineage = LineageIndex()
+indexes.append(lineage)
+
+
+# date_text: str in the format DD/MM/YYYY, returns the day number used by the date indexes
+def day_number(date_text):
+    return datetime.strptime(date_text, "%d/%m/%Y").toordinal()
+
+
+class DateIndex(BatchIndex):
+    # every event covers a range of days, single date events start and end on the same day. Both kinds are kept
+    # sorted by start day, single days are found with one bisect. Ranges are split into classes by length (class k
+    # holds ranges of 2^(k-1) to 2^k - 1 days) and each class is only searched back as far as its longest range,
+    # so a mistyped range of years only slows the search of its own class
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.days = []  # sorted list of (day, batch id, process) for single date events
+        self.ranges = {}  # length class: sorted list of (start day, end day, batch id, process) for start_dt/end_dt
+        self.longest = {}  # length class: longest range in it in days
+
+    def add_event(self, batch, record):
+        try:
+            if "start_dt" in record:
+                start = day_number(record["start_dt"])
+                end = day_number(record["end_dt"])
+                start, end = min(start, end), max(start, end)  # events saved before the order was checked
+
+                length_class = (end - start).bit_length()
+                bisect.insort(self.ranges.setdefault(length_class, []), (start, end, batch.id, record["process"]))
+                self.longest[length_class] = max(self.longest.get(length_class, 0), end - start)
+
+            elif "date" in record:
+                bisect.insort(self.days, (day_number(record["date"]), batch.id, record["process"]))
+
+        except ValueError:  # events saved before dates were validated
+            pass
+
+    # first, last: day numbers, process: str or None for any process
+    # returns set of batch ids with an event on any day from first to last
+    def overlapping(self, first, last, process=None):
+        found = set()
+
+        low = bisect.bisect_left(self.days, (first,))
+        high = bisect.bisect_left(self.days, (last + 1,))
+        for day, batch_id, event_process in self.days[low:high]:
+            if process is None or event_process == process:
+                found.add(batch_id)
+
+        for length_class, ranges in self.ranges.items():
+            low = bisect.bisect_left(ranges, (first - self.longest[length_class],))
+            high = bisect.bisect_left(ranges, (last + 1,))
+            for start, end, batch_id, event_process in ranges[low:high]:
+                if end >= first and (process is None or event_process == process):
+                    found.add(batch_id)
+
+        return found
+
+    # day: day number, returns set of batch ids with an event covering that day
+    def stabbing(self, day, process=None):
+        return self.overlapping(day, day, process)
+
+
+date_index = DateIndex()
+indexes.append(date_index)
+
+
+STAGES = ["created", "fermenting", "drying", "winnowed", "ground", "conched", "tempered/molded", "finalised"]
+PROCESS_STAGES = {"fermentation": 1, "drying": 2, "winnowing": 3, "grinding": 4,
+                  "conching": 5, "tempering_molding": 6, "finalise": 7}  # process: position in STAGES
+
+# how each process changes the weight of the batch it is recorded on
+WEIGHT_IN = ["add_ingredient", "split_from", "merge"]
+WEIGHT_OUT = ["split", "merged_into"]
+
+
+class StageIndex(BatchIndex):
+    # caches each batch's furthest stage, weight and last event date, and the totals per stage, all updated in
+    # constant time per event so the dashboard never reads a log
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.stage = {}  # batch id: position in STAGES
+        self.weight = {}  # batch id: total weight
+        self.last_day = {}  # batch id: day number of latest event
+        self.stage_counts = [0] * len(STAGES)
+        self.stage_weights = [0.0] * len(STAGES)
+        self.version = 0  # increases on every change so views can tell when to redraw
+
+    def add_batch(self, batch):
+        if batch.id in self.stage:
+            return
+
+        self.stage[batch.id] = 0
+        self.weight[batch.id] = 0.0
+        self.last_day[batch.id] = None
+        self.stage_counts[0] += 1
+        self.version += 1
+
+    def add_event(self, batch, record):
+        self.add_batch(batch)
+        batch_id = batch.id
+        process = record["process"]
+        stage = self.stage[batch_id]
+
+        if PROCESS_STAGES.get(process, 0) > stage:  # stages only move forward
+            self.stage_counts[stage] -= 1
+            self.stage_weights[stage] -= self.weight[batch_id]
+
+            stage = self.stage[batch_id] = PROCESS_STAGES[process]
+            self.stage_counts[stage] += 1
+            self.stage_weights[stage] += self.weight[batch_id]
+
+        change = 0.0
+        if process in WEIGHT_IN:
+            change = float(record["amount"])
+        elif process in WEIGHT_OUT:
+            change = -float(record["amount"])
+
+        self.weight[batch_id] += change
+        self.stage_weights[stage] += change
+
+        try:
+            day = day_number(record["date"] if "date" in record else record["end_dt"])
+            if self.last_day[batch_id] is None or day > self.last_day[batch_id]:
+                self.last_day[batch_id] = day
+
+        except ValueError:
+            pass
+
+        self.version += 1
+
+    def last_event_date(self, batch_id):
+        day = self.last_day.get(batch_id)
+        return None if day is None else datetime.fromordinal(day).strftime("%d/%m/%Y")
+
+
+stage_index = StageIndex()
+indexes.append(stage_index)
+
+
+SORT_ORDERS = ["id", "created", "last event", "stage"]
+BATCH_PAGE_SIZE = 50  # batch list rows shown per page
+
+
+class BatchOrderIndex(BatchIndex):
+    # one list of (key, batch id) per sort order, kept sorted by moving a batch's entry with bisect when its key
+    # changes, so any page of any ordering is a slice and the batches are never sorted as a whole
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.keys = {order: {} for order in SORT_ORDERS}  # order: {batch id: key}
+        self.orders = {order: [] for order in SORT_ORDERS}  # order: sorted list of (key, batch id)
+
+    # comes after stage_index in indexes, so the stage and last event are already updated for this event
+    def sort_keys(self, batch):
+        number = id_number(batch.id, "BAT")
+
+        return {"id": (0, number[1], "") if number is not None else (1, 0, batch.id),  # BAT-1000 after BAT-999
+                "created": getattr(batch, "created", 0.0),
+                "last event": stage_index.last_day.get(batch.id) or 0,
+                "stage": stage_index.stage.get(batch.id, 0)}
+
+    def move(self, order, batch_id, key):
+        keys = self.keys[order]
+        entries = self.orders[order]
+
+        if batch_id in keys:
+            if keys[batch_id] == key:
+                return
+
+            del entries[bisect.bisect_left(entries, (keys[batch_id], batch_id))]
+
+        keys[batch_id] = key
+        bisect.insort(entries, (key, batch_id))
+
+    def add_batch(self, batch):
+        for order, key in self.sort_keys(batch).items():
+            self.move(order, batch.id, key)
+
+    def add_event(self, batch, record):  # id and creation time never change after add_batch
+        self.move("last event", batch.id, stage_index.last_day.get(batch.id) or 0)
+        self.move("stage", batch.id, stage_index.stage.get(batch.id, 0))
+
+    # start: position of the first row, returns the batch ids of one page
+    def page(self, order, descending, start, count=BATCH_PAGE_SIZE):
+        entries = self.orders[order]
+
+        if descending:
+            end = len(entries) - start
+            return [batch_id for _, batch_id in reversed(entries[max(end - count, 0):max(end, 0)])]
+
+        return [batch_id for _, batch_id in entries[start:start + count]]
+
+    # batch_ids: set of str, returns the known ids among them in the given order
+    def sorted_ids(self, order, batch_ids, descending):
+        keys = self.keys[order]
+        return sorted((batch_id for batch_id in batch_ids if batch_id in keys),
+                      key=lambda batch_id: (keys[batch_id], batch_id), reverse=descending)
+
+
+batch_order = BatchOrderIndex()
+indexes.append(batch_order)
+
+
+YIELD_WINDOW = 200  # most recent batch yields the fleet statistics are taken over
+YIELD_MIN_SAMPLES = 10  # yields needed before a batch can be called an outlier
+YIELD_Z_LIMIT = 3  # standard deviations from the fleet mean that count as an outlier
+
+
+class MassBalanceIndex(BatchIndex):
+    # running input, loss and output per batch, and anomalies kept in dicts so the report never rescans the logs.
+    # Fleet yields are kept in event date order and a batch is compared with the yields recorded before its own,
+    # so the result is the same whatever order the logs are replayed in
+    def __init__(self):
+        self.reset()
+        self.deferred = False  # outside rebuild_indexes() every yield is checked as it is recorded
+
+    def reset(self):  # only called before the logs are replayed, outlier checks wait for rebuilt()
+        self.balances = {}  # batch id: {"input", "moved_out", "loss", "output"}
+        self.anomalies = {}  # batch id: reason, for batches whose own balance does not add up
+        self.outliers = {}  # batch id: reason, for yields far from the fleet's before them
+        self.order = []  # sorted list of (day number, batch id) for each batch's first yield
+        self.values = []  # first yields in the same order
+        self.squares = []  # squares of values, summed for the fleet deviation
+        self.first = {}  # batch id: its key in order
+        self.deferred = True
+        self.version = 0
+
+    def add_batch(self, batch):
+        self.balances.setdefault(batch.id, {"input": 0.0, "moved_out": 0.0, "loss": 0.0, "output": 0.0})
+
+    def add_event(self, batch, record):
+        self.add_batch(batch)
+        balance = self.balances[batch.id]
+        process = record["process"]
+
+        try:
+            if process in WEIGHT_IN:
+                balance["input"] += float(record["amount"])
+            elif process in WEIGHT_OUT:
+                balance["moved_out"] += float(record["amount"])
+            elif process == "winnowing":
+                balance["loss"] += float(record["weight_reduced"])
+            elif process == "tempering_molding" and "bar_count" in record:
+                balance["output"] += float(record["weight_per_bar"]) * record["bar_count"]
+            else:
+                return
+
+            day = day_number(record["date"])
+
+        except (TypeError, ValueError, KeyError):  # events saved before fields were validated
+            return
+
+        self.check(batch.id, day)
+        self.version += 1
+
+    def rebuilt(self):  # every log is replayed, check each yield against the fleet once
+        self.deferred = False
+
+        for batch_id in self.first:
+            self.check_outlier(batch_id)
+
+    # batch_id: str, returns output as a fraction of the weight that stayed in the batch, or None
+    def batch_yield(self, batch_id):
+        balance = self.balances[batch_id]
+        net_input = balance["input"] - balance["moved_out"]
+
+        if balance["output"] == 0 or net_input <= 0:
+            return None
+
+        return balance["output"] / net_input
+
+    # day: day number of the event that changed the balance
+    def check(self, batch_id, day):
+        balance = self.balances[batch_id]
+        net_input = balance["input"] - balance["moved_out"]
+        self.anomalies.pop(batch_id, None)
+
+        if balance["loss"] > net_input:
+            self.anomalies[batch_id] = "more lost in winnowing than went in"
+
+        batch_yield = self.batch_yield(batch_id)
+        if batch_yield is None:
+            return
+
+        if batch_yield + balance["loss"] / net_input > 1.0001:
+            self.anomalies[batch_id] = f"output and losses are {batch_yield + balance['loss'] / net_input:.0%} of input"
+
+        if batch_id in self.first:  # a later molding run changes this batch's yield but not the fleet's
+            if not self.deferred:
+                self.check_outlier(batch_id)
+            return
+
+        self.first[batch_id] = (day, batch_id)
+        position = bisect.bisect(self.order, self.first[batch_id])
+        self.order.insert(position, self.first[batch_id])
+        self.values.insert(position, batch_yield)
+        self.squares.insert(position, batch_yield * batch_yield)
+
+        if self.deferred:
+            return
+
+        # the batches up to YIELD_WINDOW after this one now have it in their window (none for a new batch's output)
+        for key in self.order[position:position + YIELD_WINDOW + 1]:
+            self.check_outlier(key[1])
+
+    def check_outlier(self, batch_id):
+        self.outliers.pop(batch_id, None)
+        batch_yield = self.batch_yield(batch_id)
+
+        if batch_id in self.anomalies or batch_yield is None:
+            return
+
+        count, mean, std = self.fleet_stats(bisect.bisect_left(self.order, self.first[batch_id]))
+
+        if count >= YIELD_MIN_SAMPLES and std > 0 and abs(batch_yield - mean) / std > YIELD_Z_LIMIT:
+            self.outliers[batch_id] = f"yield {batch_yield:.0%} against fleet {mean:.0%} +/- {std:.0%}"
+
+    # end: position in order, returns (count, mean, standard deviation) of the YIELD_WINDOW yields before it,
+    # the latest ones if end is None
+    def fleet_stats(self, end=None):
+        end = len(self.order) if end is None else end
+        start = max(end - YIELD_WINDOW, 0)
+        count = end - start
+
+        if count == 0:
+            return 0, 0.0, 0.0
+
+        mean = sum(self.values[start:end]) / count
+        return count, mean, max(sum(self.squares[start:end]) / count - mean * mean, 0) ** 0.5
+
+    def flagged(self):  # batch id: reason for every batch the report lists
+        return dict(self.outliers, **self.anomalies)
+
+
+mass_balance = MassBalanceIndex()
+indexes.append(mass_balance)
+
+
+# (process, field) pairs that make up a batch's process profile, the latest value of each is used
+PROFILE_FEATURES = [("fermentation", "duration"), ("drying", "temperature"), ("grinding", "fineness"),
+                    ("conching", "temperature"), ("tempering_molding", "melting_temp"),
+                    ("tempering_molding", "cooling_temp"), ("tempering_molding", "working_temp")]
+
+
+class SimilarityIndex(BatchIndex):
+    # one row of process profile values per batch in a numpy matrix (nan where a batch has no value yet), with
+    # running column sums so normalising for a query needs no pass over the data
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.rows = {}  # batch id: row in matrix
+        self.ids = []  # row: batch id
+        self.matrix = np.full((1024, len(PROFILE_FEATURES)), np.nan)
+        self.column_sum = np.zeros(len(PROFILE_FEATURES))
+        self.column_squares = np.zeros(len(PROFILE_FEATURES))
+        self.column_count = np.zeros(len(PROFILE_FEATURES))
+
+    def add_batch(self, batch):
+        if batch.id in self.rows:
+            return
+
+        if len(self.ids) == len(self.matrix):  # double capacity so appending stays amortised constant time
+            self.matrix = np.vstack([self.matrix, np.full(self.matrix.shape, np.nan)])
+
+        self.rows[batch.id] = len(self.ids)
+        self.ids.append(batch.id)
+
+    def add_event(self, batch, record):
+        self.add_batch(batch)
+        row = self.rows[batch.id]
+
+        for column, (process, field) in enumerate(PROFILE_FEATURES):
+            if record["process"] != process:
+                continue
+
+            try:
+                value = float(record[field])
+            except (KeyError, TypeError, ValueError):  # events saved before fields were validated
+                continue
+
+            old = self.matrix[row, column]
+            if not np.isnan(old):  # replace the earlier value in the running sums
+                self.column_sum[column] -= old
+                self.column_squares[column] -= old * old
+                self.column_count[column] -= 1
+
+            self.matrix[row, column] = value
+            self.column_sum[column] += value
+            self.column_squares[column] += value * value
+            self.column_count[column] += 1
+
+    # batch_id: str, k: int, returns up to k (batch id, distance) pairs, closest first
+    def similar(self, batch_id, k=5):
+        if batch_id not in self.rows:
+            return []
+
+        count = np.maximum(self.column_count, 1)
+        mean = self.column_sum / count
+        std = np.sqrt(np.maximum(self.column_squares / count - mean * mean, 0))
+        std[std == 0] = 1
+
+        data = self.matrix[:len(self.ids)]
+        target = (data[self.rows[batch_id]] - mean) / std
+        compared = ~np.isnan(target)  # only features the chosen batch has are compared
+
+        if not compared.any():
+            return []
+
+        values = data[:, compared]
+        scaled = np.nan_to_num((values - mean[compared]) / std[compared])  # missing values count as average
+        distance = np.sqrt(((scaled - target[compared]) ** 2).sum(axis=1))
+
+        distance[np.isnan(values).all(axis=1)] = np.inf  # batches with nothing to compare are not similar
+        distance[self.rows[batch_id]] = np.inf
+
+        k = min(k, len(distance) - 1)
+        if k <= 0:
+            return []
+
+        nearest = np.argpartition(distance, k - 1)[:k]
+        nearest = nearest[np.argsort(distance[nearest])]
+
+        return [(self.ids[row], float(distance[row])) for row in nearest if np.isfinite(distance[row])]
+
+
+similarity_index = SimilarityIndex() if np is not None else None
+if similarity_index is not None:
+    indexes.append(similarity_index)
+
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:[./-][^\W_]+)*")  # ids, decimals and dates stay one token
+SEARCH_OPERATORS = [">=", "<=", ">", "<", "=", ":"]  # two character operators are tried first
+SEARCH_FIELD_ALIASES = {"additive": "ingredient", "id": "batch"}  # edit form names for logged field names
+
+
+# value: any log field value, returns its lowercase tokens
+def tokenise(value):
+    return TOKEN_PATTERN.findall(str(value).lower())
+
+
+class TextIndex(BatchIndex):
+    # inverted index from (field, token) to the batches with that token in that field of their log, and a list of
+    # (value, batch id) per numeric field for ranges. Numeric lists are sorted by the first range query on them
+    # (rebuild_indexes only appends) and bisect inserted into from then on
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.postings = {}  # (field, token): set of batch ids
+        self.any_field = {}  # token: set of batch ids, for words without a field
+        self.numbers = {}  # field: list of (value, batch id)
+        self.values = {}  # field: values of numbers[field] in the same order, only for fields already sorted
+        self.fields = set()
+
+    def add_token(self, field, token, batch_id):
+        self.postings.setdefault((field, token), set()).add(batch_id)
+        self.any_field.setdefault(token, set()).add(batch_id)
+
+    def add_batch(self, batch):
+        self.fields.add("batch")
+        for token in tokenise(batch.id):
+            self.add_token("batch", token, batch.id)
+
+    def add_event(self, batch, record):
+        for field, value in record.items():
+            self.fields.add(field)
+
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                entries = self.numbers.setdefault(field, [])
+
+                if field in self.values:
+                    position = bisect.bisect_right(entries, (value, batch.id))
+                    entries.insert(position, (value, batch.id))
+                    self.values[field].insert(position, value)
+                else:
+                    entries.append((value, batch.id))
+
+                tokens = [f"{value:g}"]  # so temperature:45 finds 45.0
+            else:
+                tokens = tokenise(value)
+
+            for token in tokens:
+                self.add_token(field, token, batch.id)
+
+    # field: numeric field, operator: one of SEARCH_OPERATORS but ":", returns set of batch ids
+    def number_range(self, field, operator, number):
+        entries = self.numbers[field]
+
+        if field not in self.values:
+            entries.sort()
+            self.values[field] = [value for value, _ in entries]
+
+        values = self.values[field]
+        low = 0
+        high = len(values)
+
+        if operator in [">", "<="]:
+            position = bisect.bisect_right(values, number)
+        else:
+            position = bisect.bisect_left(values, number)
+
+        if operator in [">", ">="]:
+            low = position
+        elif operator in ["<", "<="]:
+            high = position
+        else:  # "="
+            low, high = position, bisect.bisect_right(values, number)
+
+        return {batch_id for _, batch_id in entries[low:high]}
+
+    # term: one word of a query, returns set of batch ids it matches
+    def match(self, term):
+        for operator in SEARCH_OPERATORS:
+            field, found, value = term.partition(operator)
+            if found and field and value:
+                break
+        else:  # no field, the tokens can be in any field
+            return set.intersection(*[self.any_field.get(token, set()) for token in tokenise(term)] or [set()])
+
+        # a field name matches every field containing it, so temp reaches temperature and melting_temp
+        field = SEARCH_FIELD_ALIASES.get(field, field)
+        fields = [name for name in self.fields if field in name]
+
+        if operator == ":":
+            found = set()
+            for name in fields:
+                found |= set.intersection(*[self.postings.get((name, token), set()) for token in tokenise(value)]
+                                          or [set()])
+            return found
+
+        number = float(value)  # ValueError is reported to the user by the search page
+        found = set()
+        for name in fields:
+            if name in self.numbers:
+                found |= self.number_range(name, operator, number)
+
+        return found
+
+    # query: str such as "additive:banana temp>45", returns set of batch ids matching every term
+    def search(self, query):
+        matches = sorted((self.match(term) for term in query.lower().split()), key=len)
+        if not matches:
+            return set()
+
+        return set.intersection(*matches)  # smallest set first
+
+
+text_index = TextIndex()
+indexes.append(text_index)
+
+
+# -----------------------------------------------------------------------------
+# COLD ARCHIVE
+# -----------------------------------------------------------------------------
+# finalised batches are read only, once they are old enough they are moved out of the batches dict into gzip
+# compressed files that are loaded on demand, so memory, save time and batch lists only grow with active work
+
+ARCHIVE_DIR = "archive"
+ARCHIVE_AFTER_DAYS = 90  # days after finalising before a batch is archived
+ARCHIVE_CACHE_SIZE = 32  # archived batches kept in memory after being viewed
+
+
+class ColdArchive:
+    # directory: str
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self.cache = collections.OrderedDict()  # batch id: Batch, least recently used first
+
+        try:
+            self.ids = {file_name[:-len(".pkl.gz")] for file_name in os.listdir(directory)
+                        if file_name.endswith(".pkl.gz")}
+        except FileNotFoundError:
+            self.ids = set()
+
+    def __contains__(self, batch_id):
+        return batch_id in self.ids
+
+    def path(self, batch_id):
+        return os.path.join(self.directory, f"{batch_id}.pkl.gz")
+
+    def add(self, batch):
+        os.makedirs(self.directory, exist_ok=True)
+
+        with gzip.open(self.path(batch.id), "wb") as file:
+            pickle.dump(batch, file)
+
+        self.ids.add(batch.id)
+
+    def remove(self, batch_id):
+        os.remove(self.path(batch_id))
+        self.ids.discard(batch_id)
+        self.cache.pop(batch_id, None)
+
+    def read(self, batch_id):
+        with gzip.open(self.path(batch_id), "rb") as file:
+            return pickle.load(file)
+
+    # batch_id: str, returns the archived Batch or None
+    def get(self, batch_id):
+        if batch_id not in self.ids:
+            return None
+
+        if batch_id in self.cache:
+            self.cache.move_to_end(batch_id)
+        else:
+            self.cache[batch_id] = self.read(batch_id)
+            if len(self.cache) > ARCHIVE_CACHE_SIZE:
+                self.cache.popitem(last=False)
+
+        return self.cache[batch_id]
+
+    # exclude: ids to skip, every other archived batch is read without keeping them in memory
+    def iter_batches(self, exclude=()):
+        for batch_id in sorted(self.ids):
+            if batch_id not in exclude:
+                yield self.read(batch_id)
+
+
+cold_archive = ColdArchive()
+
+
+# batch_id: str, returns the batch from memory or the cold archive, or None if there is no such batch
+# writing to an archived batch (for_write=True) brings it back into the batches dict, its archive file is kept
+# until save() has written the data file so a crash before then still has the archived copy
+def get_batch(batch_id, for_write=False):
+    if batch_id in batches:
+        return batches[batch_id]
+
+    batch = cold_archive.get(batch_id)
+
+    if batch is not None and for_write:
+        batches[batch_id] = batch
+
+    return batch
+
+
+def archive_finalised():
+    today = datetime.now().toordinal()
+
+    # stage index already knows which batches are finalised and their last event, so no log is read here
+    for batch_id in list(batches):
+        last_day = stage_index.last_day.get(batch_id)
+
+        if (stage_index.stage.get(batch_id) == PROCESS_STAGES["finalise"] and last_day is not None
+                and today - last_day >= ARCHIVE_AFTER_DAYS):
+            cold_archive.add(batches.pop(batch_id))
+
+
+# log helpers shared by the batch view and the generated documents
+
+# log: list of event records, returns a hash that changes whenever the log changes
+def log_digest(log):
+    return hashlib.sha256(json.dumps(log, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def is_finalised(batch):
+    return any(record["process"] == "finalise" for record in batch.get_log())
+
+
+# record: dict, returns (process name, date text, {other fields}) in the layout shown on a batch page
+def split_record(record):
+    fields = record.copy()
+    process = fields.pop("process")
+
+    if "date" in fields:
+        date_text = fields.pop("date")
+    else:
+        date_text = f"{fields.pop('start_dt')}-{fields.pop('end_dt')}"
+
+    return process, date_text, fields
+
+
+# -----------------------------------------------------------------------------
+# BULK OPERATIONS
+# -----------------------------------------------------------------------------
+# one process applied to many batches as a single transaction (e.g. several batches in the same conche run).
+# Index hooks are held back until every batch has taken the process and a rejected batch restores the snapshot,
+# so either every selected batch changes or none of them do
+
+# returns a snapshot of everything processes on batch_ids can change, source_ids are batches merges take from
+# archived batches are not copied, their files still hold them as they were until the transaction commits
+def take_snapshot(batch_ids, source_ids=()):
+    changed_ids = set(batch_ids) | set(source_ids)
+    archived_ids = {batch_id for batch_id in changed_ids if batch_id not in batches and batch_id in cold_archive}
+
+    return (dict(batches), copy.deepcopy({batch_id: batches[batch_id] for batch_id in changed_ids & batches.keys()}),
+            archived_ids, copy.deepcopy(ingredients), Batch.id_counter)
+
+
+def restore_snapshot(snapshot):
+    hot, changed, archived_ids, stock, counter = snapshot
+
+    batches.clear()  # drops batches created by splits
+    batches.update(hot)
+    batches.update(changed)
+
+    for batch_id in archived_ids:  # the cached copies may hold steps that were applied, the next get reads the file
+        cold_archive.cache.pop(batch_id, None)
+
+    ingredients.clear()
+    ingredients.update(stock)
+
+    Batch.id_counter = counter
+
+
+# steps: list of (batch id, process name, kwargs), every batch must exist
+# returns None once every step is applied and indexed, or the id of the batch that rejected its step, in which
+# case nothing is changed
+def run_transaction(steps):
+    global index_buffer
+
+    snapshot = take_snapshot({batch_id for batch_id, _, _ in steps},
+                             {str(kwargs.get("batch_id", "")).upper() for _, _, kwargs in steps})
+
+    # archived targets are changed where they are and only join the batches dict once every step is applied
+    resolved = {batch_id: get_batch(batch_id) for batch_id, _, _ in steps}
+    targets = [resolved[batch_id] for batch_id, _, _ in steps]
+    index_buffer = []
+    failed = None
+
+    try:
+        for batch, (_, method_str, kwargs) in zip(targets, steps):
+            if getattr(batch, method_str)(**kwargs) == -1:
+                failed = batch.id
+                break
+
+    except Exception:
+        index_buffer = None
+        restore_snapshot(snapshot)
+        raise
+
+    held, index_buffer = index_buffer, None
+
+    if failed is not None:
+        restore_snapshot(snapshot)
+        return failed
+
+    for batch_id, batch in resolved.items():  # archive files are removed by save() once the data file holds them
+        batches[batch_id] = batch
+
+    change_feed.hold()  # every change goes to the other windows in one write
+    for hook, args in held:
+        for index in indexes:
+            getattr(index, hook)(*args)
+    change_feed.release()
+
+    created = sorted(batches.keys() - snapshot[0].keys() - resolved.keys())  # split children
+    if created:
+        messagebox.showinfo("Notification", f"New Batch Created, id: {', '.join(created)}")
+
+
+# batch_ids: list of str, method_str: name of a Batch process, kwargs: dict of parameter: entry text
+# returns -1 if any batch rejects the process, nothing is changed in that case
+def bulk_apply(batch_ids, method_str, kwargs):
+    if not all(batch_id in batches or batch_id in cold_archive for batch_id in batch_ids):
+        messagebox.showinfo("Not Found", "A selected batch no longer exists, please reselect the batches")
+        return -1
+
+    failed = run_transaction([(batch_id, method_str, kwargs) for batch_id in batch_ids])
+
+    if failed is not None:
+        messagebox.showinfo("Notification", f"{failed} could not take {method_str}, no batch was changed")
+        return -1
+
+
+# -----------------------------------------------------------------------------
+# SITE SYNC
+# -----------------------------------------------------------------------------
+# each site keeps a journal of what it created, a delta file carries the journal entries made since the last
+# export so sites on a USB stick only exchange new activity. Event entries hold the record itself (shared with
+# the batch log when pickled) and imports are idempotent, so a delta can safely be imported more than once.
+# Ids in a delta are written "site:id at that site" for the site that made the item, so an item renamed here on
+# import goes back to its own site under its original name rather than becoming a new item there
+
+DELTA_FORMAT = "cocoa-roots-delta-2"
+OLD_DELTA_FORMATS = ["cocoa-roots-delta-1"]  # ids not site qualified, read as made by the site that exported them
+ID_FIELDS = {"parent": "BAT", "child": "BAT"}  # record fields holding ids, besides the ingredient of add_ingredient
+# ids become file names and html, so a delta is only imported if every id is one this app could have made, with
+# the site code a clashing id is given on import
+ID_PATTERNS = {"BAT": re.compile(r"BAT-\d+(-[A-Z0-9]+)?"), "ING": re.compile(r"ING-[\w ]{1,3}-\d+(-[A-Z0-9]+)?")}
+SITE_PATTERN = re.compile(r"[A-Z0-9]+")
+
+
+# prefix: "BAT" or "ING", returns (counter key, number) for ids made by this app, or None for any other id
+def id_number(item_id, prefix):
+    parts = item_id.split("-")
+
+    if len(parts) == 2 and parts[0] == prefix == "BAT" and parts[1].isdigit():
+        return None, int(parts[1])
+
+    if len(parts) == 3 and parts[0] == prefix == "ING" and parts[2].isdigit():
+        return parts[1], int(parts[2])
+
+    return None
+
+
+class SiteSync(BatchIndex):
+    derived = False  # the journal is saved with the data, replaying the logs after load() must not add to it
+
+    def __init__(self):
+        self.site = uuid.uuid4().hex[:6].upper()  # replaced by the saved site code when data is loaded
+        self.journal = []  # local entries not exported yet in creation order, numbered on from exported
+        self.exported = 0  # sequence number of the last entry written to a delta file
+        self.applied = {}  # other site code: last sequence number imported from it
+        self.id_map = {}  # (site code, id at that site): id used here
+        self.origin = {}  # id used here: (site code, id at that site) for every item made by another site
+        self.importing = False  # imported changes are not journaled, each site only exports its own activity
+
+    def state(self):
+        return {"site": self.site, "journal": self.journal, "exported": self.exported, "journal_start": self.exported,
+                "applied": self.applied, "id_map": self.id_map}
+
+    # state: dict saved by state(), or None for data saved before sync existed
+    def load_state(self, state):
+        if state is not None:
+            self.site = state["site"]
+            self.exported = state["exported"]
+            # journals saved before exported entries were dropped hold every entry from sequence number 1
+            self.journal = state["journal"][self.exported - state.get("journal_start", 0):]
+            self.applied = state["applied"]
+            self.id_map = state["id_map"]
+            self.origin = {item_id: key for key, item_id in self.id_map.items()}
+            return
+
+        # journal the existing history once, ingredients at their weight before any batch used them
+        used = {}
+        for batch in batches.values():
+            for record in batch.get_log():
+                if record["process"] == "add_ingredient":
+                    used[record["ingredient"]] = used.get(record["ingredient"], 0) + record["amount"]
+
+        for ingredient in ingredients.values():
+            self.journal.append(("ingredient", ingredient.id, ingredient.name,
+                                 ingredient.weight + used.get(ingredient.id, 0), ""))
+
+        for batch in batches.values():
+            self.add_batch(batch)
+            for record in batch.get_log():
+                self.journal.append(("event", batch.id, record))
+
+    # __________ Journal Hooks __________
+
+    def add_batch(self, batch):
+        if not self.importing:
+            self.journal.append(("batch", batch.id))
+
+    # the record is kept rather than its log position, hooks held back by a transaction run after every event of
+    # the transaction has been appended
+    def add_event(self, batch, record):
+        if not self.importing:
+            self.journal.append(("event", batch.id, record))
+
+    # ingredient: Ingredient, source: str, the weight journaled is the weight when the ingredient was added
+    def add_ingredient(self, ingredient, source):
+        if not self.importing:
+            self.journal.append(("ingredient", ingredient.id, ingredient.name, ingredient.weight, source))
+
+    # __________ Canonical Ids __________
+
+    # item_id: id used here, returns the id the site that made the item gave it
+    def canonical_id(self, item_id):
+        return self.origin.get(item_id, (None, item_id))[1]
+
+    # record: log event, returns a copy with the ids in it named as by the sites that made them (so the same event
+    # hashes the same at every site) or as "site:id" if qualify is True (how they are written to a delta)
+    def canonical_record(self, record, qualify=False):
+        record = dict(record)
+        fields = dict(ID_FIELDS, ingredient="ING") if record["process"] == "add_ingredient" else ID_FIELDS
+
+        for key in fields:
+            if key in record:
+                record[key] = self.qualify(record[key]) if qualify else self.canonical_id(record[key])
+
+        return record
+
+    def qualify(self, item_id):
+        site, origin_id = self.origin.get(item_id, (self.site, item_id))
+        return f"{site}:{origin_id}"
+
+    # __________ Export __________
+
+    # path: str, returns number of entries written
+    def export_delta(self, path):
+        entries = []
+
+        for seq, entry in enumerate(self.journal, self.exported + 1):
+            if entry[0] == "batch":
+                entries.append({"seq": seq, "kind": "batch", "id": self.qualify(entry[1])})
+
+            elif entry[0] == "event":
+                record = entry[2]
+                if isinstance(record, int):  # journals saved before records were kept held log positions
+                    record = get_batch(entry[1]).get_log()[record]
+
+                entries.append({"seq": seq, "kind": "event", "batch": self.qualify(entry[1]),
+                                "record": self.canonical_record(record, qualify=True)})
+
+            else:
+                entries.append({"seq": seq, "kind": "ingredient", "id": self.qualify(entry[1]), "name": entry[2],
+                                "weight": entry[3], "source": entry[4]})
+
+        delta = {"format": DELTA_FORMAT, "site": self.site, "from_seq": self.exported + 1,
+                 "to_seq": self.exported + len(self.journal), "entries": entries}
+
+        with open(path, "wb") as file:
+            file.write(zlib.compress(json.dumps(delta, default=str).encode()))
+
+        self.exported += len(self.journal)
+        self.journal = []  # exported entries are not kept, so the journal only holds activity since the last export
+        return len(entries)
+
+    # __________ Import __________
+
+    # remote_id: str id at the other site, local: dict of ids in use here, prefix: "BAT" or "ING"
+    # an id keeps its name unless this site has already issued it (even if that batch or lot is gone now), then
+    # it gets the site code added, so both sites settle every clash by the same rule
+    def map_id(self, site, remote_id, local, prefix):
+        key = (site, remote_id)
+
+        if key not in self.id_map:
+            number = id_number(remote_id, prefix)
+
+            if number is None:
+                issued = False
+            elif prefix == "BAT":
+                issued = number[1] < Batch.id_counter
+            else:
+                issued = number[1] < Ingredient.id_counter.get(number[0], 1)
+
+            if remote_id in local or issued:
+                self.id_map[key] = f"{remote_id}-{site}"
+                self.origin[self.id_map[key]] = key
+
+            else:  # keep local counters ahead of the id taken by the other site
+                self.id_map[key] = remote_id
+                self.origin[remote_id] = key
+
+                if prefix == "BAT" and number is not None:
+                    Batch.id_counter = number[1] + 1
+                elif number is not None:
+                    Ingredient.id_counter[number[0]] = number[1] + 1
+
+        return self.id_map[key]
+
+    # item_id: id in a delta, site: site that wrote the delta, qualified: False for ids in older deltas
+    # returns the id used here, an item this site made comes back under its own id
+    def resolve(self, item_id, site, qualified, local, prefix):
+        if qualified:
+            site, item_id = item_id.split(":", 1)
+
+        if site == self.site:
+            return item_id
+
+        return self.map_id(site, item_id, local, prefix)
+
+    # path: str, returns (entries applied, list of conflict descriptions) or -1 if the file cannot be used
+    def import_delta(self, path):
+        try:
+            with open(path, "rb") as file:
+                delta = json.loads(zlib.decompress(file.read()))
+
+        except (OSError, ValueError, zlib.error):
+            messagebox.showerror("Import Error", "The delta file could not be read")
+            return -1
+
+        if delta.get("format") != DELTA_FORMAT and delta.get("format") not in OLD_DELTA_FORMATS:
+            messagebox.showerror("Import Error", "This is not a Cocoa Roots delta file")
+            return -1
+
+        if not self.valid_delta(delta, delta["format"] == DELTA_FORMAT):
+            messagebox.showerror("Import Error", "The delta file holds a site code or id this app does not make")
+            return -1
+
+        site = delta["site"]
+        last_applied = self.applied.get(site, 0)
+
+        if site == self.site:
+            messagebox.showerror("Import Error", "This delta was exported from this site")
+            return -1
+
+        if delta["from_seq"] > last_applied + 1:  # order check, entries in between have not been imported yet
+            messagebox.showerror("Import Error", f"An earlier delta from site {site} is missing, entries "
+                                                 f"{last_applied + 1} to {delta['from_seq'] - 1} are needed first")
+            return -1
+
+        conflicts = []
+        applied = 0
+        self.importing = True
+
+        try:
+            for entry in delta["entries"]:
+                if entry["seq"] <= last_applied:  # already imported
+                    continue
+
+                self.apply_entry(site, entry, conflicts, delta["format"] == DELTA_FORMAT)
+                self.applied[site] = entry["seq"]
+                applied += 1
+
+        finally:
+            self.importing = False
+
+        return applied, conflicts
+
+    # delta: dict read from a delta file, qualified: ids are written "site:id", returns False if any site code or id
+    # does not match SITE_PATTERN and ID_PATTERNS (or the entries are not laid out as export_delta writes them)
+    def valid_delta(self, delta, qualified):
+        def valid(item_id, prefix):
+            if qualified:
+                site, separator, item_id = item_id.partition(":")
+                if not (separator and SITE_PATTERN.fullmatch(site)):
+                    return False
+
+            return ID_PATTERNS[prefix].fullmatch(item_id) is not None
+
+        try:
+            if not SITE_PATTERN.fullmatch(delta["site"]):
+                return False
+
+            for entry in delta["entries"]:
+                if entry["kind"] == "event":
+                    record = entry["record"]
+                    fields = dict(ID_FIELDS, ingredient="ING") if record["process"] == "add_ingredient" else ID_FIELDS
+
+                    if not (valid(entry["batch"], "BAT") and isinstance(record["process"], str)
+                            and all(valid(record[key], fields[key]) for key in fields if key in record)):
+                        return False
+
+                elif entry["kind"] not in ["batch", "ingredient"] or not valid(entry["id"], entry["kind"][:3].upper()):
+                    return False
+
+        except (KeyError, TypeError, AttributeError):  # missing fields or values that are not strings
+            return False
+
+        return True
+
+    # qualified: ids are written "site:id" (DELTA_FORMAT) rather than as at the site that wrote the delta
+    def apply_entry(self, site, entry, conflicts, qualified=True):
+        if entry["kind"] == "ingredient":
+            ingredient_id = self.resolve(entry["id"], site, qualified, ingredients, "ING")
+            if ingredient_id != self.canonical_id(ingredient_id):
+                conflicts.append(f"Ingredient {self.canonical_id(ingredient_id)} from {site} stored as "
+                                 f"{ingredient_id}")
+
+            ingredients[ingredient_id] = Ingredient(entry["name"], entry["weight"], entry["source"], ingredient_id)
+            index_ingredient(ingredients[ingredient_id], entry["source"])
+            return
+
+        batch_id = self.resolve(entry["id"] if entry["kind"] == "batch" else entry["batch"], site, qualified,
+                                batches, "BAT")
+
+        if get_batch(batch_id, for_write=True) is None:
+            if entry["kind"] == "batch" and batch_id != self.canonical_id(batch_id):
+                conflicts.append(f"Batch {self.canonical_id(batch_id)} from {site} stored as {batch_id}")
+
+            batches[batch_id] = Batch(batch_id)
+            index_batch(batches[batch_id])
+
+        if entry["kind"] == "batch":
+            return
+
+        record = dict(entry["record"])
+        for key in ID_FIELDS:  # batch ids inside lineage events
+            if key in record:
+                record[key] = self.resolve(record[key], site, qualified, batches, "BAT")
+
+        if record["process"] == "add_ingredient":
+            # quantities are reconciled by replaying every site's use of a lot, so the result does not depend on
+            # import order, a lot used up at both sites is removed and the overdraw reported
+            record["ingredient"] = self.resolve(record["ingredient"], site, qualified, ingredients, "ING")
+            ingredient = ingredients.get(record["ingredient"])
+
+            if ingredient is None:
+                conflicts.append(f"{batch_id} used {record['amount']} of {record['ingredient']}, which is used up "
+                                 f"or unknown here")
+            else:
+                ingredient.weight -= record["amount"]
+
+                if ingredient.weight <= 0:
+                    if ingredient.weight < 0:
+                        conflicts.append(f"{ingredient.id} overdrawn by {-ingredient.weight:g} after sync")
+                    del ingredients[ingredient.id]
+
+        batches[batch_id].import_record(record)
+
+
+site_sync = SiteSync()
+indexes.append(site_sync)
+
+
+def export_sync():
+    path = filedialog.asksaveasfilename(title="Export delta", defaultextension=".delta",
+                                        filetypes=[("Cocoa Roots delta", "*.delta")])
+    if path:
+        count = site_sync.export_delta(path)
+        messagebox.showinfo("Notification", f"{count} new entries from site {site_sync.site} written to {path}")
+
+
+def import_sync(content):
+    path = filedialog.askopenfilename(title="Import delta", filetypes=[("Cocoa Roots delta", "*.delta")])
+    if not path:
+        return -1
+
+    result = site_sync.import_delta(path)
+    if result == -1:
+        return -1
+
+    applied, conflicts = result
+    content.refresh_batch_lists()
+
+    messagebox.showinfo("Notification", f"{applied} entries imported"
+                        + ("\n\nConflicts resolved:\n" + "\n".join(conflicts) if conflicts else ""))
+
+
+# -----------------------------------------------------------------------------
+# CHANGE FEED
+# -----------------------------------------------------------------------------
+# every window open on the same data appends its changes to FEED_FILE as json lines and tails the file for
+# the others' changes, applying them in memory and telling the pages which batch and ingredient ids changed.
+# A window that saves after taking in the whole feed moves it to FEED_FILE.old and starts an empty one, so the
+# feed only holds changes since the last save. Windows still reading the end of the old file finish it first
+
+FEED_FILE = "changes.log"
+FEED_POLL_MS = 500  # how often other windows' changes are checked for
+
+
+class ChangeFeed(BatchIndex):
+    derived = False  # replaying the logs after load() must not publish them again
+
+    # path: str
+    def __init__(self, path=FEED_FILE):
+        self.path = path
+        self.instance = uuid.uuid4().hex  # tells this window's lines apart from the others'
+        self.offset = None  # bytes of the feed already taken in, None until data is loaded
+        self.inode = None  # inode of the feed file offset is in, which may since have been moved to FEED_FILE.old
+        self.applying = False  # changes from other windows are not published again
+        self.held = None  # lines kept back while a bulk operation commits, written together by release()
+        self.taken = set()  # ids claimed by other windows, never issued here even if a rollback lowers a counter
+        self.recovered = {}  # batch id: (inode, offset) of the feed its copy taken from the data file includes
+
+    @staticmethod
+    def inode_of(path):  # returns None if there is no such file
+        try:
+            return os.stat(path).st_ino
+        except FileNotFoundError:
+            return None
+
+    # offset, inode: feed position the loaded data file already includes, offset is None for data saved before the
+    # feed existed and inode is None for data saved before the feed was rotated
+    def start(self, offset, inode=None):
+        open(self.path, "a").close()  # the file is made here so its inode can be followed
+        current = self.inode_of(self.path)
+        size = os.path.getsize(self.path)
+
+        if offset is not None and inode is not None and inode in [current, self.inode_of(self.path + ".old")]:
+            self.inode, self.offset = inode, offset  # the first poll reads the rest of the old file if it was moved
+        elif offset is not None and inode is None and offset <= size:
+            self.inode, self.offset = current, offset
+        else:
+            self.inode, self.offset = current, size
+
+    # returns (list of (inode, offset after the line, line) not taken in yet, feed position after them)
+    # a window that missed two rotations starts the current file from its beginning
+    def unread(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return [], (self.inode, self.offset)
+
+        if stat.st_ino == self.inode and stat.st_size <= self.offset:  # nothing new, skip opening the file
+            return [], (self.inode, self.offset)
+
+        sources = [(self.path, stat.st_ino, self.offset if stat.st_ino == self.inode else 0)]
+        if stat.st_ino != self.inode and self.inode_of(self.path + ".old") == self.inode:
+            sources.insert(0, (self.path + ".old", self.inode, self.offset))
+
+        lines = []
+        end = 0
+
+        for path, inode, end in sources:
+            try:
+                with open(path, "rb") as file:
+                    file.seek(end)
+                    data = file.read()
+            except FileNotFoundError:
+                continue
+
+            for line in data[:data.rfind(b"\n") + 1].splitlines(keepends=True):  # a line still being written waits
+                end += len(line)
+                lines.append((inode, end, line))
+
+        return lines, (stat.st_ino, end)
+
+    # called by save() after poll(), moves the feed aside once every line in it has been taken in here
+    def rotate(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+
+        if stat.st_ino != self.inode or stat.st_size != self.offset or self.offset == 0:
+            return
+
+        os.replace(self.path, self.path + ".old")  # replaces the file moved aside by the save before
+        open(self.path, "a").close()
+        self.inode, self.offset = self.inode_of(self.path), 0
+
+    def publish(self, change):
+        if self.applying or self.offset is None:
+            return
+
+        change["instance"] = self.instance
+        line = json.dumps(change, default=str) + "\n"
+
+        if self.held is not None:
+            self.held.append(line)
+            return
+
+        with open(self.path, "a") as file:
+            file.write(line)
+
+    def hold(self):
+        self.held = []
+
+    # item_id: new batch or ingredient id, returns False if another window claimed it first
+    # claims skip hold() and are read back at once, the first claim for an id in the file wins
+    def claim(self, item_id):
+        if self.offset is None:  # data not loaded, nothing else can be issuing ids
+            return True
+
+        if item_id in self.taken:
+            return False
+
+        with open(self.path, "a") as file:
+            file.write(json.dumps({"kind": "claim", "id": item_id, "instance": self.instance}) + "\n")
+
+        lines, position = self.unread()
+
+        for inode, end, line in lines:
+            try:
+                change = json.loads(line)
+                if change["kind"] in ["claim", "batch", "ingredient"] and change["id"] == item_id:
+                    return change["instance"] == self.instance
+            except (ValueError, KeyError, TypeError):
+                continue
+
+        return True
+
+    def release(self):
+        lines, self.held = self.held, None
+
+        if lines:
+            with open(self.path, "a") as file:
+                file.write("".join(lines))
+
+    # __________ Publish Hooks __________
+
+    def add_batch(self, batch):
+        self.publish({"kind": "batch", "id": batch.id})
+
+    def add_event(self, batch, record):
+        self.publish({"kind": "event", "batch": batch.id, "record": record})
+
+    def add_ingredient(self, ingredient, source):
+        self.publish({"kind": "ingredient", "id": ingredient.id, "name": ingredient.name,
+                      "weight": ingredient.weight, "source": source})
+
+    # __________ Subscribe __________
+
+    # returns (set of changed batch ids, set of changed ingredient ids) from other windows since the last poll
+    def poll(self):
+        changed_batches = set()
+        changed_ingredients = set()
+
+        if self.offset is None:
+            return changed_batches, changed_ingredients
+
+        lines, (self.inode, self.offset) = self.unread()
+        self.applying = True
+
+        try:
+            for inode, end, line in lines:
+                try:
+                    change = json.loads(line)
+                    if change["instance"] != self.instance:
+                        self.apply(change, changed_batches, changed_ingredients, (inode, end))
+                except (ValueError, KeyError, TypeError):  # a damaged line is skipped, the rest still apply
+                    continue
+
+        finally:
+            self.applying = False
+
+        return changed_batches, changed_ingredients
+
+    # position: (inode, offset) of the feed just after the change's line
+    def apply(self, change, changed_batches, changed_ingredients, position):
+        if change["kind"] == "claim":  # keep counters past ids other windows are about to use
+            self.taken.add(change["id"])
+            number = id_number(change["id"], change["id"].split("-")[0])
+
+            if number is not None and number[0] is None:
+                Batch.id_counter = max(Batch.id_counter, number[1] + 1)
+            elif number is not None:
+                Ingredient.id_counter[number[0]] = max(Ingredient.id_counter.get(number[0], 1), number[1] + 1)
+            return
+
+        if change["kind"] == "ingredient":
+            ingredients[change["id"]] = Ingredient(change["name"], change["weight"], change["source"], change["id"])
+            index_ingredient(ingredients[change["id"]], change["source"])
+
+            number = id_number(change["id"], "ING")
+            if number is not None:
+                Ingredient.id_counter[number[0]] = max(Ingredient.id_counter.get(number[0], 1), number[1] + 1)
+
+            changed_ingredients.add(change["id"])
+            return
+
+        batch_id = change["id"] if change["kind"] == "batch" else change["batch"]
+
+        try:
+            batch = get_batch(batch_id, for_write=True)
+        except FileNotFoundError:  # the window that changed it saved it to the data file and removed its archive
+            batch = self.recover(batch_id)
+
+        if batch is None:
+            batch = batches[batch_id] = Batch(batch_id)
+            index_batch(batch)
+
+            number = id_number(batch_id, "BAT")
+            if number is not None:
+                Batch.id_counter = max(Batch.id_counter, number[1] + 1)
+
+        changed_batches.add(batch_id)
+
+        if change["kind"] == "batch":
+            return
+
+        record = change["record"]
+        if record["process"] == "add_ingredient" and record["ingredient"] in ingredients:
+            ingredient = ingredients[record["ingredient"]]
+            ingredient.weight -= record["amount"]
+            changed_ingredients.add(ingredient.id)
+
+            if ingredient.weight <= 0:
+                del ingredients[ingredient.id]
+
+        if self.included(position, self.recovered.get(batch_id)):
+            index_event(batch, record)  # already in the log of the copy taken from the data file
+        else:
+            batch.import_record(record)
+
+    # batch_id: archived batch whose archive file is gone, returns its copy in the data file (or None)
+    def recover(self, batch_id):
+        cold_archive.ids.discard(batch_id)
+        cold_archive.cache.pop(batch_id, None)
+
+        with open(FILE_NAME, "rb") as file:
+            content = pickle.load(file)
+
+        if batch_id not in content["batches"]:
+            return None
+
+        batches[batch_id] = content["batches"][batch_id]
+        self.recovered[batch_id] = (content.get("feed_inode") or self.inode, content.get("feed_offset") or 0)
+        return batches[batch_id]
+
+    # position: feed position after a line, saved: feed position a data file was saved at, or None
+    # returns True if the line was taken in before that save, a line in the file moved aside is before a save in
+    # the current file
+    def included(self, position, saved):
+        if saved is None:
+            return False
+
+        if position[0] == saved[0]:
+            return position[1] <= saved[1]
+
+        return saved[0] == self.inode
+
+
+change_feed = ChangeFeed()
+indexes.append(change_feed)
+
+
+# -----------------------------------------------------------------------------
+# MERKLE PROOFS
+# -----------------------------------------------------------------------------
+# finalising a batch hashes its events into a merkle tree and the root goes into the finalise record. Every
+# finalised batch is added to a ledger whose entries are chained and also form a merkle tree, so a consumer can
+# check one event or one whole batch against the published ledger root with a proof of O(log n) hashes
+
+# record: dict, hash of one log event (leaves and nodes are prefixed differently so a node cannot pose as a leaf)
+def event_hash(record):
+    return hashlib.sha256(b"\x00" + json.dumps(record, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# log: list of event records, ids are hashed as named by the sites that made them so a batch synced from another
+# site (where its ids may be renamed) still matches the merkle root in its finalise record
+def log_hashes(log):
+    return [event_hash(site_sync.canonical_record(record)) for record in log]
+
+
+def node_hash(left, right):
+    return hashlib.sha256(b"\x01" + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+# leaves: list of hex hashes, returns every level of the tree from the leaves up to the root
+# an unpaired node is carried up unchanged rather than paired with itself
+def merkle_levels(leaves):
+    levels = [list(leaves) or [hashlib.sha256(b"").hexdigest()]]
+
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        levels.append([node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                       for i in range(0, len(level), 2)])
+
+    return levels
+
+
+def merkle_root(leaves):
+    return merkle_levels(leaves)[-1][0]
+
+
+# levels: from merkle_levels, position: leaf position, returns list of [side, sibling hash] from leaf to root
+def merkle_proof(levels, position):
+    proof = []
+
+    for level in levels[:-1]:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append(["left" if sibling < position else "right", level[sibling]])
+        position //= 2
+
+    return proof
+
+
+# leaf: hex hash, proof: from merkle_proof, root: hex hash
+def verify_proof(leaf, proof, root):
+    current = leaf
+    for side, sibling in proof:
+        current = node_hash(sibling, current) if side == "left" else node_hash(current, sibling)
+
+    return current == root
+
+
+def batch_leaf(batch_id, root):
+    return hashlib.sha256(b"\x00" + f"{batch_id}:{root}".encode()).hexdigest()
+
+
+# proof: dict made by MerkleLedger.batch_proof, checks every event it carries and the batch against the ledger
+def verify_batch_proof(proof):
+    if not verify_proof(batch_leaf(proof["batch"], proof["batch_root"]), proof["batch_proof"], proof["ledger_root"]):
+        return False
+
+    return all(verify_proof(event_hash(event["event"]), event["proof"], proof["batch_root"])
+               for event in proof["events"])
+
+
+class MerkleLedger(BatchIndex):
+    derived = False  # the ledger order is part of what is proven, so it is saved rather than rebuilt
+
+    def __init__(self):
+        self.entries = []  # [batch id, merkle root, chain hash] in the order batches were finalised
+        self.positions = {}  # batch id: position of its latest ledger entry
+        self.levels = None  # cached tree over the ledger, dropped whenever an entry is added
+
+    def state(self):
+        return self.entries
+
+    # entries: list saved by state(), or None for data saved before the ledger existed
+    def load_state(self, entries):
+        self.entries = []
+        self.positions = {}
+        self.levels = None
+
+        if entries is not None:
+            for batch_id, root, chain_hash in entries:
+                self.positions[batch_id] = len(self.entries)
+                self.entries.append([batch_id, root, chain_hash])
+            return
+
+        for batch in chain(batches.values(), cold_archive.iter_batches(exclude=batches)):  # ledger history once
+            for position, record in enumerate(batch.get_log()):
+                if record["process"] == "finalise":
+                    self.add_entry(batch.id, merkle_root(log_hashes(batch.get_log()[:position])))
+
+    def add_event(self, batch, record):
+        if record["process"] == "finalise":
+            self.add_entry(batch.id, record["merkle_root"])
+
+    def add_entry(self, batch_id, root):
+        previous = self.entries[-1][2] if self.entries else ""
+        chain_hash = hashlib.sha256(f"{previous}:{batch_id}:{root}".encode()).hexdigest()
+
+        self.positions[batch_id] = len(self.entries)
+        self.entries.append([batch_id, root, chain_hash])
+        self.levels = None
+
+    def ledger_levels(self):
+        if self.levels is None:
+            self.levels = merkle_levels([batch_leaf(batch_id, root) for batch_id, root, chain_hash in self.entries])
+
+        return self.levels
+
+    def ledger_root(self):
+        return self.ledger_levels()[-1][0]
+
+    # batch_id: str, log: list of event records, returns a proof dict for the batch and each event it finalised,
+    # checked against the ledger root at the time it is made, or None if the batch is not finalised
+    def batch_proof(self, batch_id, log):
+        if batch_id not in self.positions:
+            return None
+
+        position = self.positions[batch_id]
+        batch_id, root, chain_hash = self.entries[position]
+
+        finalised = max(index for index, record in enumerate(log) if record["process"] == "finalise")
+        events = [site_sync.canonical_record(event) for event in log[:finalised]]
+        event_levels = merkle_levels([event_hash(event) for event in events])
+
+        return {"batch": batch_id,
+                "batch_root": root,
+                "batch_proof": merkle_proof(self.ledger_levels(), position),
+                "ledger_root": self.ledger_root(),
+                "ledger_size": len(self.entries),
+                "chain_hash": chain_hash,
+                "events": [{"event": event, "proof": merkle_proof(event_levels, index)}
+                           for index, event in enumerate(events)]}
+
+
+merkle_ledger = MerkleLedger()
+indexes.append(merkle_ledger)
+
+
+# events: int, builds batch trees and a ledger over that many events and times proofs, run with --benchmark
+def benchmark_merkle(events=100000, events_per_batch=20):
+    log = [{"process": "conching", "temperature": 40 + i % 10, "date": "01/01/2024"} for i in range(events_per_batch)]
+    batch_count = events // events_per_batch
+
+    start = time.perf_counter()
+    leaves = [event_hash(dict(record, batch=batch_num)) for batch_num in range(batch_count) for record in log]
+    roots = [merkle_root(leaves[i:i + events_per_batch]) for i in range(0, len(leaves), events_per_batch)]
+    ledger_levels = merkle_levels([batch_leaf(f"BAT-{i:03d}", root) for i, root in enumerate(roots)])
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    proofs = [merkle_proof(ledger_levels, position) for position in range(batch_count)]
+    proof_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    valid = all(verify_proof(batch_leaf(f"BAT-{i:03d}", roots[i]), proofs[i], ledger_levels[-1][0])
+                for i in range(batch_count))
+    verify_seconds = time.perf_counter() - start
+
+    print(f"{events} events in {batch_count} batches")
+    print(f"hash events, batch roots and ledger: {build_seconds:.3f}s")
+    print(f"batch proofs: {proof_seconds / batch_count * 1e6:.1f}us each, {len(proofs[0])} hashes "
+          f"({len(json.dumps(proofs[0]))} bytes)")
+    print(f"verify: {verify_seconds / batch_count * 1e6:.1f}us each, all valid: {valid}")
+
+
+# -----------------------------------------------------------------------------
+# BATCH CERTIFICATES
+# -----------------------------------------------------------------------------
+# one html certificate per finalised batch, written by a process pool, a manifest of log digests means a batch
+# is only rendered again when its log has changed since its last certificate
+
+CERTIFICATE_DIR = "certificates"
+POOL_THRESHOLD = 20  # below this many certificates starting worker processes costs more than it saves
+
+
+# log: list of event records, returns an html table laid out like the batch view page
+def log_table_html(log):
+    rows = []
+    for record in log:
+        process, date_text, fields = split_record(record)
+        details = "<br>".join(f"{html.escape(str(key))}: {html.escape(str(value))}" for key, value in fields.items())
+        rows.append(f"<tr><td>{html.escape(process)}</td><td>{html.escape(date_text)}</td><td>{details}</td></tr>")
+
+    return ("<table border=\"1\">\n<tr><th>Process</th><th>Date</th><th>Details</th></tr>\n"
+            + "\n".join(rows) + "\n</table>\n")
+
+
+# batch_id: str, log: list of event records, proof: dict from MerkleLedger.batch_proof or None
+def render_certificate(batch_id, log, proof):
+    verification = [record for record in log if record["process"] == "finalise"][-1]
+
+    return ("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+            f"<title>Cocoa Roots certificate {html.escape(batch_id)}</title></head>\n<body>\n"
+            f"<h1>Cocoa Roots batch certificate</h1>\n<h2>{html.escape(batch_id)}</h2>\n"
+            f"<p>Verification number: {html.escape(str(verification['verification_num']))}<br>"
+            f"Finalised: {html.escape(verification['date'])}</p>\n"
+            + ("" if proof is None else
+               f"<p>Merkle root: <code>{proof['batch_root']}</code><br>"
+               f"Ledger root: <code>{proof['ledger_root']}</code> ({proof['ledger_size']} batches)<br>"
+               f"Proof: <a href=\"{html.escape(batch_id)}.proof.json\">{html.escape(batch_id)}.proof.json</a></p>\n")
+            + log_table_html(log) + "</body></html>\n")
+
+
+# job: (batch_id, log, path, proof), run inside worker processes so it only uses the data it is given
+def write_certificate(job):
+    batch_id, log, path, proof = job
+
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(render_certificate(batch_id, log, proof))
+
+    if proof is not None:
+        with open(path[:-len(".html")] + ".proof.json", "w", encoding="utf-8") as file:
+            json.dump(proof, file, default=str)
+
+    return batch_id
+
+
+# returns (generated, skipped, seconds)
+def generate_certificates(directory=CERTIFICATE_DIR, workers=None):
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, "manifest.pkl")
+
+    try:
+        with open(manifest_path, "rb") as file:
+            manifest = pickle.load(file)  # batch id: digest of the log its certificate was made from
+    except FileNotFoundError:
+        manifest = {}
+
+    jobs = []
+    digests = {}
+    skipped = 0
+
+    # archived batches cannot change, they are only read if they have never had a certificate
+    archived = (cold_archive.get(batch_id) for batch_id in sorted(cold_archive.ids - batches.keys())
+                if batch_id not in manifest)
+
+    for batch in chain(batches.values(), archived):
+        if not is_finalised(batch):
+            continue
+
+        digest = log_digest(batch.get_log())
+        if manifest.get(batch.id) == digest and os.path.exists(os.path.join(directory, f"{batch.id}.html")):
+            skipped += 1
+            continue
+
+        digests[batch.id] = digest
+        jobs.append((batch.id, batch.get_log(), os.path.join(directory, f"{batch.id}.html"),
+                     merkle_ledger.batch_proof(batch.id, batch.get_log())))
+
+    start = time.perf_counter()
+
+    if len(jobs) < POOL_THRESHOLD:
+        finished = list(map(write_certificate, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            finished = list(pool.map(write_certificate, jobs, chunksize=max(1, len(jobs) // 64)))
+
+    for batch_id in finished:
+        manifest[batch_id] = digests[batch_id]
+
+    with open(manifest_path, "wb") as file:
+        pickle.dump(manifest, file)
+
+    return len(finished), skipped, time.perf_counter() - start
+
+
+def certificates_report():
+    generated, skipped, seconds = generate_certificates()
+    rate = generated / seconds if seconds > 0 else 0
+
+    messagebox.showinfo("Certificates", f"{generated} certificates generated in {seconds:.2f}s "
+                                        f"({rate:.0f} per second)\n{skipped} unchanged batches skipped\n"
+                                        f"Saved to {CERTIFICATE_DIR}/")
+
+
+# -----------------------------------------------------------------------------
+# STATIC SITE
+# -----------------------------------------------------------------------------
+# one html page per batch (what the consumer batch view shows) plus a searchable index page, for QR codes that
+# work without the app or a server. A manifest of log digests means only batches whose log changed are rendered
+
+SITE_DIR = "site"
+
+SITE_INDEX_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Cocoa Roots batches</title>
+<script src="search_index.js"></script></head>
+<body>
+<h1>Cocoa Roots</h1>
+<input id="search" placeholder="Batch id, e.g. BAT-001" oninput="show()" autofocus>
+<ul id="results"></ul>
+<script>
+function show() {
+    var value = document.getElementById("search").value.toUpperCase();
+    var items = BATCHES.filter(function (batch) { return batch.id.indexOf(value) !== -1; }).slice(0, 50);
+    document.getElementById("results").innerHTML = items.map(function (batch) {
+        return '<li><a href="batches/' + batch.id + '.html">' + batch.id + '</a> ' + batch.stage +
+               ' ' + (batch.last || '') + '</li>';
+    }).join('');
+}
+show();
+</script>
+</body></html>
+"""
+
+
+# batch_id: str, log: list of event records
+def render_batch_page(batch_id, log):
+    return ("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+            f"<title>Cocoa Roots {html.escape(batch_id)}</title></head>\n<body>\n"
+            f"<p><a href=\"../index.html\">All batches</a></p>\n<h1>{html.escape(batch_id)}</h1>\n"
+            + log_table_html(log) + "</body></html>\n")
+
+
+# returns (pages written, pages unchanged, seconds)
+def build_site(directory=SITE_DIR):
+    start = time.perf_counter()
+    os.makedirs(os.path.join(directory, "batches"), exist_ok=True)
+    manifest_path = os.path.join(directory, "manifest.json")
+
+    try:
+        with open(manifest_path) as file:
+            manifest = json.load(file)  # batch id: digest of the log its page was made from
+    except FileNotFoundError:
+        manifest = {}
+
+    written = 0
+    unchanged = sum(1 for batch_id in cold_archive.ids - batches.keys() if batch_id in manifest)
+
+    # archived batches cannot change, they are only read if they do not have a page yet
+    archived = (cold_archive.get(batch_id) for batch_id in sorted(cold_archive.ids - batches.keys())
+                if batch_id not in manifest)
+
+    for batch in chain(batches.values(), archived):
+        digest = log_digest(batch.get_log())
+        page_path = os.path.join(directory, "batches", f"{batch.id}.html")
+
+        if manifest.get(batch.id) == digest and os.path.exists(page_path):
+            unchanged += 1
+            continue
+
+        with open(page_path, "w", encoding="utf-8") as file:
+            file.write(render_batch_page(batch.id, batch.get_log()))
+
+        manifest[batch.id] = digest
+        written += 1
+
+    index_path = os.path.join(directory, "index.html")
+    if written or not os.path.exists(index_path):
+        # search entries come from the stage index so writing them does not read any log
+        search_index = [{"id": batch_id, "stage": STAGES[stage], "last": stage_index.last_event_date(batch_id)}
+                        for batch_id, stage in sorted(stage_index.stage.items())]
+
+        with open(os.path.join(directory, "search_index.js"), "w", encoding="utf-8") as file:
+            file.write("var BATCHES = " + json.dumps(search_index) + ";\n")
+
+        with open(index_path, "w", encoding="utf-8") as file:
+            file.write(SITE_INDEX_PAGE)
+
+        with open(manifest_path, "w") as file:
+            json.dump(manifest, file)
+
+    return written, unchanged, time.perf_counter() - start
+
+
+def site_report():
+    written, unchanged, seconds = build_site()
+    messagebox.showinfo("Website", f"{written} batch pages written, {unchanged} unchanged, in {seconds:.2f}s\n"
+                                   f"Open {SITE_DIR}/index.html")
+
+
+# -----------------------------------------------------------------------------
+# SENSOR TELEMETRY
+# -----------------------------------------------------------------------------
+# probe readings are stored per batch and stage under TELEMETRY_DIR/<batch id>/<stage>/ as zlib compressed chunks
+# of delta encoded integers, with an index of chunk summaries so range queries and plots only decode what they need
+
+TELEMETRY_DIR = "telemetry"
+TELEMETRY_STAGES = ["fermentation", "drying", "conching"]  # Batch methods that have temperature probes
+CHUNK_SIZE = 4096  # samples per chunk file
+BLOCK_SIZES = [512, 64]  # samples per block summary kept in the index for each chunk, coarsest first
+VALUE_SCALE = 100  # readings are stored as integer hundredths of a degree
+
+
+class TelemetryStore:
+    # directory: str
+    def __init__(self, directory=TELEMETRY_DIR):
+        self.directory = directory
+        # (batch_id, stage): list of chunk summaries [start, end, count, min, max, file name, levels], levels holds
+        # a list of [start, end, count, min, max] block summaries for each of BLOCK_SIZES (missing in older indexes)
+        self.indexes = {}
+
+    def series_dir(self, batch_id, stage):
+        return os.path.join(self.directory, batch_id, stage)
+
+    # chunk summaries are cached after the first read, chunks are ordered and do not overlap in time
+    def chunk_index(self, batch_id, stage):
+        key = (batch_id, stage)
+
+        if key not in self.indexes:
+            try:
+                with open(os.path.join(self.series_dir(batch_id, stage), "index.pkl"), "rb") as file:
+                    self.indexes[key] = pickle.load(file)
+
+            except FileNotFoundError:
+                self.indexes[key] = []
+
+        return self.indexes[key]
+
+    def has_series(self, batch_id, stage):
+        return len(self.chunk_index(batch_id, stage)) > 0
+
+    # samples: list of (timestamp: float seconds, value: float), stored as integer seconds and scaled values
+    @staticmethod
+    def encode(samples):
+        times = [int(timestamp) for timestamp, value in samples]
+        values = [int(round(value * VALUE_SCALE)) for timestamp, value in samples]
+
+        # first delta is taken from zero so the chunk holds its own absolute starting point
+        deltas = array("q", [len(samples)])
+        deltas.extend(now - before for now, before in zip(times, [0] + times))
+        deltas.extend(now - before for now, before in zip(values, [0] + values))
+
+        return zlib.compress(deltas.tobytes())
+
+    # data: bytes, returns list of (timestamp: int, value: float)
+    @staticmethod
+    def decode(data):
+        deltas = array("q")
+        deltas.frombytes(zlib.decompress(data))
+
+        count = deltas[0]
+        times = accumulate(deltas[1:count + 1])
+        values = accumulate(deltas[count + 1:])
+
+        return [(timestamp, value / VALUE_SCALE) for timestamp, value in zip(times, values)]
+
+    def read_chunk(self, batch_id, stage, summary):
+        with open(os.path.join(self.series_dir(batch_id, stage), summary[5]), "rb") as file:
+            return self.decode(file.read())
+
+    def write_chunk(self, batch_id, stage, file_name, samples):
+        with open(os.path.join(self.series_dir(batch_id, stage), file_name), "wb") as file:
+            file.write(self.encode(samples))
+
+        return self.summarise(samples) + [file_name, [[self.summarise(samples[offset:offset + size])
+                                                       for offset in range(0, len(samples), size)]
+                                                      for size in BLOCK_SIZES]]
+
+    @staticmethod
+    def summarise(samples):  # [start, end, count, min, max] of a run of samples
+        values = [value for timestamp, value in samples]
+        return [int(samples[0][0]), int(samples[-1][0]), len(samples), min(values), max(values)]
+
+    # samples: list of (timestamp: float seconds, value: float)
+    # returns number of samples stored, samples not after the end of the existing series are skipped
+    def append(self, batch_id, stage, samples):
+        index = self.chunk_index(batch_id, stage)
+        os.makedirs(self.series_dir(batch_id, stage), exist_ok=True)
+
+        samples = sorted(samples)
+        if index:
+            samples = [sample for sample in samples if int(sample[0]) > index[-1][1]]
+
+        if not samples:
+            return 0
+
+        # top up the last chunk so small appends do not leave many tiny chunks behind
+        if index and index[-1][2] < CHUNK_SIZE:
+            summary = index.pop()
+            pending = self.read_chunk(batch_id, stage, summary) + samples
+            chunk_num = len(index)
+        else:
+            pending = samples
+            chunk_num = len(index)
+
+        for offset in range(0, len(pending), CHUNK_SIZE):
+            index.append(self.write_chunk(batch_id, stage, f"chunk_{chunk_num:05d}.bin",
+                                          pending[offset:offset + CHUNK_SIZE]))
+            chunk_num += 1
+
+        with open(os.path.join(self.series_dir(batch_id, stage), "index.pkl"), "wb") as file:
+            pickle.dump(index, file)
+
+        return len(samples)
+
+    # chunk summaries overlapping start to end (timestamps in seconds)
+    def overlapping(self, batch_id, stage, start, end):
+        index = self.chunk_index(batch_id, stage)
+        first = bisect.bisect_left([summary[1] for summary in index], start)  # first chunk ending after start
+
+        for summary in index[first:]:
+            if summary[0] > end:
+                break
+            yield summary
+
+    # every sample between start and end (timestamps in seconds)
+    def query(self, batch_id, stage, start, end):
+        result = []
+        for summary in self.overlapping(batch_id, stage, start, end):
+            result.extend(sample for sample in self.read_chunk(batch_id, stage, summary)
+                          if start <= sample[0] <= end)
+
+        return result
+
+    # (first, last) timestamp of the series, or None if there are no samples
+    def time_range(self, batch_id, stage):
+        index = self.chunk_index(batch_id, stage)
+        if not index:
+            return None
+
+        return index[0][0], index[-1][1]
+
+    # splits start to end into buckets (one per pixel when plotting) and returns (min, max) for each bucket, or
+    # None for empty buckets. Each chunk is answered from the coarsest block summaries no wider than a bucket, a
+    # block spanning two buckets counts towards both, so only blocks cut by the ends of the range are decoded
+    def downsample(self, batch_id, stage, start, end, buckets):
+        result = [None] * buckets
+        width = max(end - start, 1) / buckets
+
+        def merge(bucket, low, high):
+            bucket = min(max(int(bucket), 0), buckets - 1)
+            if result[bucket] is None:
+                result[bucket] = (low, high)
+            else:
+                result[bucket] = (min(result[bucket][0], low), max(result[bucket][1], high))
+
+        def merge_samples(samples):
+            for timestamp, value in samples:
+                if start <= timestamp <= end:
+                    merge((timestamp - start) // width, value, value)
+
+        for summary in self.overlapping(batch_id, stage, start, end):
+            first_bucket = (summary[0] - start) // width
+            last_bucket = (summary[1] - start) // width
+
+            if first_bucket == last_bucket and summary[0] >= start and summary[1] <= end:
+                merge(first_bucket, summary[3], summary[4])
+                continue
+
+            # average time a block of each size covers in this chunk, the coarsest no wider than a bucket is used
+            span = (summary[1] - summary[0]) / max(summary[2] - 1, 1)
+            levels = summary[6] if len(summary) > 6 else []
+            level = next((position for position, size in enumerate(BLOCK_SIZES)
+                          if position < len(levels) and span * size <= width), None)
+
+            if level is None:  # zoomed in past the finest blocks (or an index written before blocks were kept)
+                merge_samples(self.read_chunk(batch_id, stage, summary))
+                continue
+
+            size = BLOCK_SIZES[level]
+            samples = None  # decoded only if a block is cut by the range or spreads over a gap in the readings
+
+            for position, block in enumerate(levels[level]):
+                if block[1] < start or block[0] > end:
+                    continue
+
+                first_bucket = (block[0] - start) // width
+                last_bucket = (block[1] - start) // width
+
+                if block[0] >= start and block[1] <= end and last_bucket - first_bucket <= 1:
+                    merge(first_bucket, block[3], block[4])
+                    merge(last_bucket, block[3], block[4])
+                    continue
+
+                if samples is None:
+                    samples = self.read_chunk(batch_id, stage, summary)
+                merge_samples(samples[position * size:(position + 1) * size])
+
+        return result
+
+
+telemetry = TelemetryStore()
+
+
+# path: str, csv file of "timestamp,value" lines where timestamp is DD/MM/YYYY HH:MM:SS or seconds since epoch
+def import_probe_csv(batch_id, stage, path):
+    samples = []
+
+    with open(path) as file:
+        for line in file:
+            fields = line.strip().split(",")
+            if len(fields) < 2:
+                continue
+
+            try:
+                value = float(fields[1])
+            except ValueError:  # header or damaged line
+                continue
+
+            try:
+                timestamp = float(fields[0])
+            except ValueError:
+                try:
+                    timestamp = datetime.strptime(fields[0].strip(), "%d/%m/%Y %H:%M:%S").timestamp()
+                except ValueError:
+                    continue
+
+            samples.append((timestamp, value))
+
+    if not samples:
+        messagebox.showerror("Import Error", "No readings were found, lines must be in the format timestamp,value")
+        return -1
+
+    stored = telemetry.append(batch_id, stage, samples)
+    messagebox.showinfo("Notification", f"{stored} of {len(samples)} {stage} readings stored for {batch_id}")
+
+
+# canvas: tk.Canvas, bounds: list of (min, max) or None per pixel column
+def draw_telemetry(canvas, bounds, height):
+    readings = [bound for bound in bounds if bound is not None]
+    if not readings:
+        return
+
+    low = min(bound[0] for bound in readings)
+    high = max(bound[1] for bound in readings)
+    scale = (height - 10) / max(high - low, 0.01)
+
+    for column, bound in enumerate(bounds):
+        if bound is not None:  # vertical line from min to max keeps spikes visible at any zoom
+            canvas.create_line(column, height - 5 - (bound[0] - low) * scale,
+                               column, height - 6 - (bound[1] - low) * scale, fill=RED)
+
+    canvas.create_text(2, 2, anchor="nw", text=f"{high:g}", font=("Calabi", 7))
+    canvas.create_text(2, height - 2, anchor="sw", text=f"{low:g}", font=("Calabi", 7))
+
+
+# -----------------------------------------------------------------------------
+# CAPACITY SCHEDULE
+# -----------------------------------------------------------------------------
+# plans the processes that hold a tank, dryer or conche for days so no unit is booked twice. Units of each size
+# are kept in a heap by the day they are next free and a batch takes the earliest free unit big enough for its
+# weight, stage durations are running means of the durations already logged
+
+EQUIPMENT_FILE = "equipment.json"  # {process: {unit name: capacity}, "durations": {process: days}} overrides
+SCHEDULED_PROCESSES = ["fermentation", "drying", "conching"]  # in the order a batch goes through them
+DEFAULT_EQUIPMENT = {"fermentation": {"Tank 1": 500.0, "Tank 2": 500.0, "Tank 3": 1000.0},
+                     "drying": {"Dryer 1": 1000.0, "Dryer 2": 1000.0},
+                     "conching": {"Conche 1": 250.0, "Conche 2": 500.0}}
+DEFAULT_DURATIONS = {"fermentation": 6, "drying": 7, "conching": 2}  # days, used until a duration is logged
+
+
+# day: day number, returns str in the format DD/MM/YYYY
+def day_text(day):
+    return datetime.fromordinal(day).strftime("%d/%m/%Y")
+
+
+class CapacityScheduler(BatchIndex):
+    # the plan is rebuilt lazily after logged events change weights or stages, a new empty batch is only added
+    # to the end of the current plan so creating batches never replans the whole season
+    unsaved = ("equipment", "fixed_durations")  # read from the equipment file
+
+    def __init__(self):
+        self.equipment = DEFAULT_EQUIPMENT
+        self.fixed_durations = {}  # process: days set in the equipment file, used instead of learned durations
+        self.reset()
+
+    def reset(self):
+        self.duration_sum = dict.fromkeys(SCHEDULED_PROCESSES, 0)
+        self.duration_count = dict.fromkeys(SCHEDULED_PROCESSES, 0)
+        self.running = {}  # batch id: (process, start day, end day) of its latest logged fermentation or drying
+        self.stale = True  # the plan no longer matches the logs
+        self.today = None
+        self.planned = set()  # batch ids in the current plan
+        self.version = 0  # increases on every new plan so views can tell when to redraw
+
+    # path: str, the defaults are kept if there is no equipment file
+    def load_equipment(self, path=EQUIPMENT_FILE):
+        if not os.path.exists(path):
+            return
+
+        try:
+            with open(path) as file:
+                config = json.load(file)
+
+            equipment = {process: {str(name): float(capacity) for name, capacity in config[process].items()}
+                         for process in SCHEDULED_PROCESSES}
+            durations = {process: max(int(days), 1) for process, days in config.get("durations", {}).items()}
+
+        except (KeyError, TypeError, ValueError, AttributeError):  # JSONDecodeError is a ValueError
+            messagebox.showerror("Equipment Error", f"{path} must list unit name: capacity pairs for "
+                                                    f"{', '.join(SCHEDULED_PROCESSES)}")
+            return -1
+
+        if equipment != self.equipment or durations != self.fixed_durations:
+            self.equipment = equipment
+            self.fixed_durations = durations
+            self.stale = True
+
+    # process: str, returns whole days the process is planned to take
+    def duration(self, process):
+        if process in self.fixed_durations:
+            return self.fixed_durations[process]
+
+        if self.duration_count[process]:
+            return max(round(self.duration_sum[process] / self.duration_count[process]), 1)
+
+        return DEFAULT_DURATIONS[process]
+
+    # __________ Index Hooks __________
+
+    def add_batch(self, batch):
+        if self.stale or batch.id in self.planned:
+            self.stale = True
+            return
+
+        self.plan_batch(batch.id)
+        self.version += 1
+
+    def add_event(self, batch, record):
+        process = record["process"]
+
+        if process in SCHEDULED_PROCESSES and "duration" in record:
+            try:
+                start = day_number(record["start_dt"])
+                end = day_number(record["end_dt"])
+            except ValueError:  # events saved before dates were validated
+                start = end = None
+
+            if start is not None and end > start:
+                self.duration_sum[process] += end - start
+                self.duration_count[process] += 1
+                self.running[batch.id] = (process, start, end)
+
+        self.stale = True
+
+    # __________ Planning __________
+
+    def ensure_plan(self):
+        if self.stale or self.today != datetime.now().toordinal():
+            self.plan()
+
+    def plan(self):
+        self.today = datetime.now().toordinal()
+        self.free = {}  # process: {capacity: heap of (day free, unit name)}
+        self.capacities = {}  # process: sorted capacities of its units
+        self.holder = {}  # (process, unit name): batch id booked last
+        self.bookings = []  # (start day, end day, process, unit name, batch id)
+        self.unplaced = {}  # batch id: reason
+        self.conflicts = []
+        self.planned = set()
+
+        for process in SCHEDULED_PROCESSES:
+            self.free[process] = {}
+            for name, capacity in self.equipment[process].items():
+                self.free[process].setdefault(capacity, []).append((self.today, name))
+
+            for heap in self.free[process].values():
+                heapq.heapify(heap)
+
+            self.capacities[process] = sorted(self.free[process])
+
+        # batches already fermenting or drying hold their unit from the day they started, so they go in first
+        for batch_id, (process, start, end) in sorted(self.running.items(), key=lambda item: item[1][1]):
+            if end > self.today and stage_index.stage.get(batch_id) == PROCESS_STAGES[process]:
+                self.book(batch_id, process, start, end - start, fixed=True)
+
+        for batch_id in sorted(stage_index.stage):
+            self.plan_batch(batch_id)
+
+        self.stale = False
+        self.version += 1
+
+    # books every scheduled process the batch has not reached yet, each one starting when the last ends
+    def plan_batch(self, batch_id):
+        self.planned.add(batch_id)
+        stage = stage_index.stage.get(batch_id, 0)
+        ready = self.today
+
+        if batch_id in self.running and self.running[batch_id][2] > ready:
+            ready = self.running[batch_id][2]
+
+        for process in SCHEDULED_PROCESSES:
+            if PROCESS_STAGES[process] <= stage or batch_id in self.unplaced:
+                continue
+
+            ready = self.book(batch_id, process, ready, self.duration(process))
+
+    # fixed: bool, True for a process already logged, which keeps its dates even if the unit is taken
+    # returns the day the batch leaves the unit
+    def book(self, batch_id, process, ready, days, fixed=False):
+        weight = stage_index.weight.get(batch_id, 0.0)
+        capacities = self.capacities[process]
+
+        best = None
+        for capacity in capacities[bisect.bisect_left(capacities, weight):]:  # only units big enough
+            heap = self.free[process][capacity]
+            if best is None or heap[0][0] < best[0][0]:  # ties keep the smallest unit free for larger batches
+                best = (heap[0], heap)
+
+        if best is None:
+            self.unplaced[batch_id] = f"{weight:g} is more than any {process} unit holds"
+            return ready
+
+        (free_day, name), heap = best
+        start = ready if fixed else max(ready, free_day)
+
+        if fixed and free_day > self.today:
+            self.conflicts.append(f"{batch_id} {process} from {day_text(start)} overlaps "
+                                  f"{self.holder[(process, name)]} in {name}")
+
+        end = start + days
+        heapq.heapreplace(heap, (max(end, free_day), name))
+        self.holder[(process, name)] = batch_id
+        self.bookings.append((start, end, process, name, batch_id))
+
+        return end
+
+
+capacity_scheduler = CapacityScheduler()
+indexes.append(capacity_scheduler)
+
+
+# -----------------------------------------------------------------------------
+# COOPERATIVE RENDERING
+# -----------------------------------------------------------------------------
+# long UI rebuilds are written as generators that yield after each small unit of work, the scheduler runs them
+# in time boxed slices between Tk events so the window keeps responding to input
+
+SLICE_BUDGET_MS = 12  # longest a slice of render work may hold the mainloop before yielding to input
+
+
+class RenderScheduler:
+    # widget: tk.Misc used for after calls, progress_bar: ttk.Progressbar shown while work is pending
+    def __init__(self, widget, progress_bar):
+        self.widget = widget
+        self.progress_bar = progress_bar
+
+        self.tasks = {}  # key: task dict, one task per widget being rebuilt
+        self.stale = {}  # page class: {key: restart function} for work cancelled when its page was left
+        self.after_id = None
+
+    # key: widget being rebuilt (a newer task for the same widget replaces the old one), page: page class the
+    # work belongs to or None for work that must finish wherever the user goes, steps: generator yielding
+    # (done, total) after each unit of work, restart: function
+    def start(self, key, page, steps, restart):
+        # started and work (seconds spent in steps) give the rebuild time recorded when the task finishes
+        self.tasks[key] = {"page": page, "steps": steps, "restart": restart, "done": 0, "total": 1,
+                           "started": time.perf_counter(), "work": 0.0}
+
+        if page in self.stale:
+            self.stale[page].pop(key, None)  # fresh work supersedes a cancelled rebuild
+
+        if self.after_id is None:
+            self.after_id = self.widget.after_idle(self.run_slice)
+
+        self.update_progress()
+
+    # page: page class being navigated to, work for every other page is stopped and remembered as stale
+    def cancel_hidden(self, page):
+        for key in list(self.tasks):
+            task = self.tasks[key]
+            if task["page"] is not None and task["page"] != page:
+                self.stale.setdefault(task["page"], {})[key] = task["restart"]
+                del self.tasks[key]
+
+        self.update_progress()
+
+    # page: page class now shown, restart any of its rebuilds that were cancelled earlier
+    def resume(self, page):
+        for restart in self.stale.pop(page, {}).values():
+            restart()
+
+    def run_slice(self):
+        self.after_id = None
+        start = time.perf_counter()
+        deadline = start + SLICE_BUDGET_MS / 1000
+
+        for key in list(self.tasks):
+            task = self.tasks.get(key)
+            while task is self.tasks.get(key) and time.perf_counter() < deadline:
+                step_start = time.perf_counter()
+                try:
+                    task["done"], task["total"] = next(task["steps"])
+                    task["work"] += time.perf_counter() - step_start
+                except StopIteration:
+                    task["work"] += time.perf_counter() - step_start
+                    del self.tasks[key]
+                    self.finished(key, task)
+
+            if time.perf_counter() >= deadline:
+                break
+
+        if INSTRUMENT:
+            monitor.record("render slice", (time.perf_counter() - start) * 1000)
+
+        self.update_progress()
+
+        if self.tasks:  # after() rather than after_idle() so pending input is handled before the next slice
+            self.after_id = self.widget.after(1, self.run_slice)
+
+    # the page methods that start a task return at once, so a rebuild is timed here under the widget's class name:
+    # time spent in its steps, and time from start to finish including other work and input between slices
+    def finished(self, key, task):
+        if INSTRUMENT:
+            monitor.record(f"{type(key).__name__} rebuild", task["work"] * 1000)
+            monitor.record(f"{type(key).__name__} rebuild elapsed", (time.perf_counter() - task["started"]) * 1000)
+
+    def update_progress(self):
+        if not self.tasks:
+            self.progress_bar.pack_forget()
+            return
+
+        done = sum(task["done"] for task in self.tasks.values())
+        total = sum(task["total"] for task in self.tasks.values())
+
+        self.progress_bar.config(value=100 * done / max(total, 1))
+        self.progress_bar.pack(padx=5, side=tk.RIGHT)
+
+
+# -----------------------------------------------------------------------------
+# GUI INTERFACE
+# -----------------------------------------------------------------------------
+
+class Window(tk.Tk):
+    def __init__(self, *args, **kwargs):
+        tk.Tk.__init__(self, *args, **kwargs)
+
+        self.logo = ImageTk.PhotoImage(Image.open("Resources/Bean_Logo.png"))
+
+        # adjust window features
+        self.config(bg="blue")
+        self.geometry("400x600")  # window dimensions
+        self.title("Cocoa Roots")
+        self.grid_columnconfigure(1, weight=1)  # make expandable with screen
+        self.grid_rowconfigure(2, weight=1)
+
+        style = ttk.Style()  # set ttk style (to format scroll bars)
+        style.theme_use("clam")
+
+        # titlebar
+        self.title_bar = tk.Frame(height=4, bg=ORANGE)
+        self.title_bar.grid(row=1, column=1, sticky="ew")
+
+        logo_label = tk.Label(self.title_bar, image=self.logo, bg=ORANGE)
+        logo_label.pack(side=tk.LEFT)
+
+        title_text = tk.Label(self.title_bar, text="Cocoa Roots", font=("Bernard MT Condensed", 25), bg=ORANGE)
+        title_text.pack(side=tk.LEFT)
+
+        # Put content below titlebar
+        self.content = Content(self)
+        self.content.grid(row=2, column=1, sticky="nsew")
+
+
+class Content(tk.Frame):
+    def __init__(self, parent):
+        tk.Frame.__init__(self, bg=BACKGROUND, height=20, borderwidth=1, relief="solid")
+        self.grid_rowconfigure(1, weight=1)
+        self.grid_columnconfigure(1, weight=1)
+
+        self.back_track = {}  # keep track of page navigation
+        # place button in titlebar
+        self.back_button = tk.Button(parent.title_bar,
+                                     text="<",
+                                     width=7,
+                                     height=2,
+                                     bg=LIGHT_ORANGE,
+                                     borderwidth=1,
+                                     relief="solid",
+                                     command=lambda: self.go_back()
+                                     )
+
+        # progress of chunked page rebuilds, shown in titlebar only while work is pending
+        progress_bar = ttk.Progressbar(parent.title_bar, orient="horizontal", length=60, mode="determinate")
+        self.scheduler = RenderScheduler(self, progress_bar)
+
+        self.pages = {}  # dictionary of sub-frames within content
+
+        page_list = [UserPage, WorkerPage, ConsumerPage, IngredientPage, EditBatchPage, ViewBatchPage,
+                     DashboardPage, MassBalancePage, SchedulePage, SearchPage]
+        if INSTRUMENT:
+            page_list.append(DiagnosticsPage)
+
+        # use of for loop control structure to minimise repetition in code
+        for page in page_list:  # for every page within content
+            page_class = page(parent=self)  # create frame class
+
+            self.pages[page] = page_class
+
+            page_class.grid(row=1, column=1, sticky="nsew")
+
+        self.current_page = UserPage
+        self.switch_page(UserPage)
+
+        self.after(FEED_POLL_MS, self.poll_changes)
+
+    def navigate(self, page_name):  # user navigation that records previous page
+        self.back_track[page_name] = self.current_page
+        self.scheduler.cancel_hidden(page_name)  # stop rebuilding pages the user has left
+        self.switch_page(page_name)
+
+    def go_back(self):  # switches to previous page
+        last_page = self.back_track[self.current_page]
+        self.scheduler.cancel_hidden(last_page)
+        self.switch_page(last_page)
+
+    def poll_changes(self):  # patch pages with changes made in other open windows
+        try:
+            changed_batches, changed_ingredients = change_feed.poll()
+
+            if changed_batches:
+                self.pages[WorkerPage].scroll_area.patch_batches(changed_batches)
+                self.pages[ConsumerPage].scroll_area.patch_batches(changed_batches)
+
+                view_page = self.pages[ViewBatchPage]
+                if view_page.batch_id in changed_batches:
+                    view_page.update_page(view_page.batch_id)
+
+            edit_page = self.pages[EditBatchPage]
+            if changed_ingredients and edit_page.batch_id:
+                edit_page.update_page(edit_page.batch_id, edit_page.batch_ids)  # refresh ingredient weights
+
+        finally:  # one failed poll must not stop the window following the others
+            self.after(FEED_POLL_MS, self.poll_changes)
+
+    def refresh_batch_lists(self):  # reload both worker and consumer batch lists
+        self.pages[WorkerPage].scroll_area.update_batch_list()
+        self.pages[ConsumerPage].scroll_area.update_batch_list()
+
+    def switch_page(self, page_name):
+        if page_name in self.back_track:  # if there is a page before current
+            self.back_button.pack(padx=10, side=tk.RIGHT)  # show back button
+        else:
+            self.back_button.pack_forget()  # hide back button
+
+        self.current_page = page_name
+        page = self.pages[page_name]
+        page.tkraise()  # bring frame to front (switch page)
+
+        self.scheduler.resume(page_name)  # finish any rebuild that was cancelled while page was hidden
+
+
+class UserPage(tk.Frame):  # menu to select user type
+    def __init__(self, parent):
+        tk.Frame.__init__(self, parent, bg=BACKGROUND, height=20, borderwidth=1, relief="solid")
+        self.grid_rowconfigure(1, weight=1)
+        self.grid_rowconfigure(2, weight=1)
+        self.grid_columnconfigure(1, weight=1)
+
+        worker_button = tk.Button(self,
+                                  text="Worker",
+                                  bg=LIGHT_BLUE,
+                                  height=7,
+                                  width=30,
+                                  borderwidth=1,
+                                  relief="solid",
+                                  command=lambda: parent.navigate(WorkerPage)
+                                  )
+        worker_button.grid(row=1, column=1)
+
+        consumer_button = tk.Button(self,
+                                    text="Consumer",
+                                    bg=LIGHT_BLUE,
+                                    height=7,
+                                    width=30,
+                                    borderwidth=1,
+                                    relief="solid",
+                                    command=lambda: parent.navigate(ConsumerPage)
+                                    )
+        consumer_button.grid(row=2, column=1)
+
+
+class WorkerPage(tk.Frame):
+    def __init__(self, parent):
+        tk.Frame.__init__(self, parent, height=20, borderwidth=1, relief="solid")
+
+        self.batch_id = ""
+        self.parent = parent
+
+        self.grid_rowconfigure(1, weight=1)
+        self.grid_rowconfigure(2, weight=1)
+        self.grid_rowconfigure(5, weight=2)
+
+        self.grid_columnconfigure(1, weight=1)
+
+        # __________ Ingredient Frame __________
+        ingredient_frame = tk.Frame(self,
+                                    bg=LIGHT_BLUE,
+                                    height=50,
+                                    width=50,
+                                    borderwidth=1,
+                                    relief="solid"
+                                    )
+        ingredient_frame.grid(row=1, column=1, padx=15, sticky="we")
+
+        ingredient_frame.grid_propagate(False)  # keep specified dimensions
+        ingredient_frame.rowconfigure(1, weight=1)
+        ingredient_frame.columnconfigure(1, weight=1)
+
+        ingredient_label = tk.Label(ingredient_frame,
+                                    bg=LIGHT_BLUE,
+                                    text="Add Ingredient"
+                                    )
+        ingredient_label.grid(row=1, column=1, sticky="w", padx=5)
+
+        ingredient_button = tk.Button(ingredient_frame,
+                                      bg=LIGHT_ORANGE,
+                                      text="+",
+                                      font=("Calabi", 12),
+                                      padx=5,
+                                      command=lambda: parent.navigate(IngredientPage)
+                                      )
+        ingredient_button.grid(row=1, column=2, sticky="e", padx=5)
+
+        # __________ Batches Frame __________
+        batches_frame = tk.Frame(self,
+                                 bg=LIGHT_BLUE,
+                                 height=50,
+                                 width=50,
+                                 borderwidth=1,
+                                 relief="solid"
+                                 )
+        batches_frame.grid(row=2, column=1, padx=15, sticky="nwe")
+
+        batches_frame.grid_propagate(False)  # keep specified dimensions
+        batches_frame.rowconfigure(1, weight=1)
+        batches_frame.columnconfigure(1, weight=1)
+
+        batches_label = tk.Label(batches_frame,
+                                 bg=LIGHT_BLUE,
+                                 text="Add Batch"
+                                 )
+        batches_label.grid(row=1, column=1, sticky="w", padx=5)
+
+        bulk_button = tk.Button(batches_frame,
+                                bg=LIGHT_ORANGE,
+                                text="Edit selected",
+                                padx=5,
+                                command=lambda: self.edit_selected()
+                                )
+        bulk_button.grid(row=1, column=2, sticky="e", padx=5)
+
+        batches_button = tk.Button(batches_frame,
+                                   bg=LIGHT_ORANGE,
+                                   text="+",
+                                   font=("Calabi", 12),
+                                   padx=5,
+                                   command=lambda: self.add_batch()
+                                   )
+        batches_button.grid(row=1, column=3, sticky="e", padx=5)
+
+        # __________ Tools Frame __________
+        self.tools_frame = tk.Frame(self,
+                                    bg=LIGHT_BLUE,
+                                    height=50,
+                                    width=50,
+                                    borderwidth=1,
+                                    relief="solid"
+                                    )
+        self.tools_frame.grid(row=3, column=1, padx=15, pady=(0, 10), sticky="nwe")
+
+        self.tools_frame.grid_propagate(False)  # keep specified dimensions
+        self.tools_frame.rowconfigure(1, weight=1)
+
+        certificates_button = tk.Button(self.tools_frame,
+                                        bg=LIGHT_ORANGE,
+                                        text="Certificates",
+                                        padx=5,
+                                        command=lambda: certificates_report()
+                                        )
+        certificates_button.grid(row=1, column=1, padx=5)
+
+        dashboard_button = tk.Button(self.tools_frame,
+                                     bg=LIGHT_ORANGE,
+                                     text="Dashboard",
+                                     padx=5,
+                                     command=lambda: self.open_page(DashboardPage)
+                                     )
+        dashboard_button.grid(row=1, column=2, padx=5)
+
+        export_button = tk.Button(self.tools_frame,
+                                  bg=LIGHT_ORANGE,
+                                  text="Export",
+                                  padx=5,
+                                  command=lambda: export_sync()
+                                  )
+        export_button.grid(row=1, column=3, padx=5)
+
+        import_button = tk.Button(self.tools_frame,
+                                  bg=LIGHT_ORANGE,
+                                  text="Import",
+                                  padx=5,
+                                  command=lambda: import_sync(parent)
+                                  )
+        import_button.grid(row=1, column=4, padx=5)
+
+        site_button = tk.Button(self.tools_frame,
+                                bg=LIGHT_ORANGE,
+                                text="Website",
+                                padx=5,
+                                command=lambda: site_report()
+                                )
+        site_button.grid(row=1, column=5, padx=5)
+
+        balance_button = tk.Button(self.tools_frame,
+                                   bg=LIGHT_ORANGE,
+                                   text="Yield",
+                                   padx=5,
+                                   command=lambda: self.open_page(MassBalancePage)
+                                   )
+        balance_button.grid(row=1, column=6, padx=5)
+
+        schedule_button = tk.Button(self.tools_frame,
+                                    bg=LIGHT_ORANGE,
+                                    text="Schedule",
+                                    padx=5,
+                                    command=lambda: self.open_page(SchedulePage)
+                                    )
+        schedule_button.grid(row=1, column=7, padx=5)
+
+        search_button = tk.Button(self.tools_frame,
+                                  bg=LIGHT_ORANGE,
+                                  text="Search",
+                                  padx=5,
+                                  command=lambda: self.open_page(SearchPage)
+                                  )
+        search_button.grid(row=1, column=8, padx=5)
+
+        # __________ Date Filter __________
+        filter_frame = tk.Frame(self, bg=LIGHT_BLUE, borderwidth=1, relief="solid")
+        filter_frame.grid(row=4, column=1, padx=15, pady=(0, 10), sticky="we")
+
+        filter_frame.columnconfigure(1, weight=1)
+
+        # DD/MM/YYYY for one day or DD/MM/YYYY-DD/MM/YYYY for a range, empty shows every batch
+        self.filter_entry = tk.Entry(filter_frame)
+        self.filter_entry.grid(row=1, column=1, padx=5, pady=5, sticky="we")
+
+        self.process_choice = ttk.Combobox(filter_frame,
+                                           state="readonly",
+                                           width=14,
+                                           values=["any"] + [method for method in dir(Batch)
+                                                             if method[:1] != "_"
+                                                             and method not in NON_PROCESS_ATTRIBUTES]
+                                           )
+        self.process_choice.set("any")
+        self.process_choice.grid(row=1, column=2, padx=5)
+
+        filter_button = tk.Button(filter_frame,
+                                  bg=LIGHT_ORANGE,
+                                  text="Filter",
+                                  padx=5,
+                                  command=lambda: self.filter_batches()
+                                  )
+        filter_button.grid(row=1, column=3, padx=5)
+
+        # __________ Existing Batches __________
+
+        content_frame = tk.Frame(self, bg=BLACK)  # black frame to create boarder
+        content_frame.grid(row=5, column=1, sticky="nsew", pady=(0, 20), padx=10)
+
+        self.scroll_area = ScrollableBatchList(content_frame, parent, "worker")
+        self.scroll_area.pack(fill="both", expand=True, pady=3, padx=3)
+
+    def add_batch(self):
+        instance = Batch()
+        instance_id = instance.id
+
+        batches[instance_id] = instance  # add batch instance to dictionary
+        index_batch(instance)
+
+        self.parent.refresh_batch_lists()  # reload worker and user page batch lists
+
+    def edit_selected(self):  # apply processes to every ticked batch at once
+        batch_ids = sorted(self.scroll_area.selected)
+
+        if not batch_ids:
+            messagebox.showerror("Existence Error", "Please tick the batches to edit")
+            return -1
+
+        self.parent.navigate(EditBatchPage)
+        self.parent.pages[EditBatchPage].update_page(batch_ids[0], batch_ids)
+
+    def open_page(self, page_name):  # navigate to a tools page and load its content
+        self.parent.navigate(page_name)
+        self.parent.pages[page_name].update_page()
+
+    def filter_batches(self):  # show only batches with an event in the entered dates
+        date_text = self.filter_entry.get().strip()
+
+        if not date_text:
+            self.scroll_area.filter_ids = None
+            self.scroll_area.change_order()
+            return
+
+        try:
+            days = [day_number(part.strip()) for part in date_text.split("-")]
+
+        except ValueError:
+            messagebox.showerror("Type Error", "Dates must be inputted in the format DD/MM/YYYY or "
+                                               "DD/MM/YYYY-DD/MM/YYYY")
+            return -1
+
+        if len(days) > 2 or days[0] > days[-1]:  # range check
+            messagebox.showerror("Range Error", "Please enter one date or a start date before an end date")
+            return -1
+
+        process = self.process_choice.get()
+        self.scroll_area.filter_ids = date_index.overlapping(days[0], days[-1], None if process == "any" else process)
+        self.scroll_area.change_order()  # back to the first page
+
+
+class IngredientPage(tk.Frame):
+    def __init__(self, parent):
+        tk.Frame.__init__(self, parent, height=20, borderwidth=1, relief="solid")
+        self.grid_rowconfigure(1, weight=1)
+        self.grid_rowconfigure(2, weight=4)
+
+        self.grid_columnconfigure(1, weight=1)
+
+        # __________ Page Title __________
+        title_frame = tk.Frame(self,
+                               bg=LIGHT_BLUE,
+                               height=50,
+                               width=50,
+                               borderwidth=1,
+                               relief="solid"
+                               )
+        title_frame.grid(row=1, column=1, padx=15, sticky="we")
+
+        title_frame.grid_propagate(False)
+        title_frame.rowconfigure(1, weight=1)
+        title_frame.columnconfigure(1, weight=1)
+
+        title_label = tk.Label(title_frame,
+                               bg=LIGHT_BLUE,
                                text="Add Ingredient"
                                )
         title_label.grid(row=1, column=1)
@@ -681,6 +3668,7 @@ class IngredientPage(tk.Frame):
         instance = Ingredient(name, weight, source)
         instance_id = instance.id
         ingredients[instance_id] = instance
+        index_ingredient(instance, source)
 
         messagebox.showinfo("Notification", f"New Ingredient Added, id: {instance_id}")
 
@@ -690,11 +3678,23 @@ class IngredientPage(tk.Frame):
         #     print(f"{key}: {key_value}")
 
 
+SCAN_BATCH_SIZE = 20  # checked scans committed together in one transaction
+SCAN_ERRORS_SHOWN = 4  # rows of the rapid entry error list
+
+
 class EditBatchPage(tk.Frame):
     def __init__(self, parent):
         tk.Frame.__init__(self, parent, height=20, borderwidth=1, relief="solid")
 
         self.batch_id = ""
+        self.batch_ids = []  # every batch a submitted process is applied to, more than one in bulk mode
+        self.parent = parent
+
+        self.scan_queue = collections.deque()  # (batch id, scanned line) waiting to be checked
+        self.scan_pending = {}  # batch id: list of checked (ingredient id, amount) waiting to be committed
+        self.scan_reserved = {}  # ingredient id: amount taken by checked scans not yet committed
+        self.scan_ingredient = None  # ingredient id scanned on its own line, waiting for its weight
+        self.scan_added = 0
 
         self.grid_rowconfigure(1, weight=1)
         self.grid_rowconfigure(2, weight=3)
@@ -721,6 +3721,14 @@ class EditBatchPage(tk.Frame):
                                     )
         self.title_label.grid(row=1, column=1)
 
+        scan_button = tk.Button(title_frame,
+                                bg=LIGHT_ORANGE,
+                                text="Scan",
+                                padx=5,
+                                command=lambda: self.toggle_scan()
+                                )
+        scan_button.grid(row=1, column=2, padx=5)
+
         # __________ Page Content __________
         self.method_entries = {}
 
@@ -730,9 +3738,32 @@ class EditBatchPage(tk.Frame):
         self.scroll_area = ScrollableBatchFunctions(content_frame, self)
         self.scroll_area.pack(expand=True, pady=3, padx=3)
 
-    def update_page(self, instance_id):
+        # __________ Rapid Entry __________
+        # a handheld scanner types "ingredient id weight" (or the id and the weight as two lines) and presses
+        # return, lines are queued and checked in scheduler slices so a burst of scans never waits on the log
+        self.scan_frame = tk.Frame(self, bg=LIGHT_BLUE, borderwidth=1, relief="solid")
+        self.scan_frame.columnconfigure(1, weight=1)
+
+        self.scan_entry = tk.Entry(self.scan_frame)
+        self.scan_entry.grid(row=1, column=1, padx=5, pady=5, sticky="we")
+        self.scan_entry.bind("<Return>", lambda event: self.queue_scan())
+
+        self.scan_label = tk.Label(self.scan_frame, bg=LIGHT_BLUE, text="", width=22, anchor="e")
+        self.scan_label.grid(row=1, column=2, padx=5)
+
+        self.scan_errors = tk.Listbox(self.scan_frame, height=SCAN_ERRORS_SHOWN, fg=RED)
+        self.scan_errors.grid(row=2, column=1, columnspan=2, padx=5, pady=(0, 5), sticky="we")
+
+    # batch_ids: list of batch ids for bulk mode, None edits instance_id alone
+    def update_page(self, instance_id, batch_ids=None):
         self.batch_id = instance_id
-        self.title_label.config(text=instance_id)
+        self.batch_ids = batch_ids or [instance_id]
+
+        if len(self.batch_ids) == 1:
+            self.title_label.config(text=instance_id)
+        else:
+            shown = ", ".join(self.batch_ids[:4]) + (", ..." if len(self.batch_ids) > 4 else "")
+            self.title_label.config(text=f"{len(self.batch_ids)} batches: {shown}")
 
         self.scroll_area.notification_text = ("ID                               Weight\n"
                                               "----------------------------------------")
@@ -741,9 +3772,148 @@ class EditBatchPage(tk.Frame):
         for ingredient in ingredients.values():
             self.scroll_area.notification_text += f"\n{ingredient.id}:             {ingredient.weight}"
 
-    def alter_batch(self, method_str):
-        method_func = getattr(batches[self.batch_id], method_str)
+    # __________ Rapid Entry __________
+
+    def toggle_scan(self):  # show or hide the rapid entry bar under the process forms
+        if self.scan_frame.winfo_ismapped():
+            self.scan_frame.grid_remove()
+        else:
+            self.scan_frame.grid(row=3, column=1, padx=10, pady=(0, 10), sticky="we")
+            self.scan_entry.focus_set()
+
+    def queue_scan(self):
+        line = self.scan_entry.get().strip()
+        self.scan_entry.delete(0, tk.END)
+
+        if not line:
+            return
+
+        if len(self.batch_ids) > 1:
+            self.scan_error(line, "scans are added to one batch at a time")
+            return
+
+        self.scan_queue.append((self.batch_id, line))
+
+        # scans belong to no page, leaving the edit page must not leave them unchecked and uncommitted
+        if self not in self.parent.scheduler.tasks:
+            self.parent.scheduler.start(self, None, self.check_scans(), None)
+
+        self.update_scan_label()
+
+    def finish_scans(self):  # check and commit every queued scan now, used by save() before the window closes
+        self.parent.scheduler.tasks.pop(self, None)
+
+        for _ in self.check_scans():
+            pass
+
+    def check_scans(self):
+        done = 0
+
+        while self.scan_queue:
+            batch_id, line = self.scan_queue.popleft()
+            self.check_scan(batch_id, line)
+
+            if sum(len(scans) for scans in self.scan_pending.values()) >= SCAN_BATCH_SIZE:
+                self.commit_scans()
+
+            done += 1
+            yield done, done + len(self.scan_queue)
+
+        self.commit_scans()  # queue drained, commit the rest of the burst
+
+    # checks against the ingredients dict and what earlier scans already took, errors are listed, not shown in
+    # a messagebox, so the operator can keep scanning
+    def check_scan(self, batch_id, line):
+        fields = line.replace(",", " ").split()
+        waiting, self.scan_ingredient = self.scan_ingredient, None
+
+        if len(fields) == 1 and waiting is None:
+            if fields[0].upper() not in ingredients:
+                self.scan_error(line, "not an ingredient id in stock")
+                return
+
+            self.scan_ingredient = fields[0].upper()  # weight comes on the next line
+            return
+
+        if len(fields) == 1:
+            ingredient_id, amount_text = waiting, fields[0]
+        elif len(fields) == 2:
+            ingredient_id, amount_text = fields[0].upper(), fields[1]
+        else:
+            self.scan_error(line, "expected an ingredient id and a weight")
+            return
+
+        if waiting is not None and len(fields) == 2:
+            self.scan_error(waiting, "no weight was scanned")
+
+        if ingredient_id not in ingredients:
+            self.scan_error(line, f"{ingredient_id} is not in stock")
+            return
+
+        try:
+            amount = float(amount_text)
+        except ValueError:
+            self.scan_error(line, f"{amount_text} is not a weight")
+            return
+
+        available = ingredients[ingredient_id].weight - self.scan_reserved.get(ingredient_id, 0)
+        if not 0 < amount <= available:  # range check
+            self.scan_error(line, f"weight must be more than zero and no more than {available:g}")
+            return
+
+        self.scan_reserved[ingredient_id] = self.scan_reserved.get(ingredient_id, 0) + amount
+        self.scan_pending.setdefault(batch_id, []).append((ingredient_id, amount))
+
+    # one transaction, index flush and inventory refresh for the whole micro-batch. Stock is checked again
+    # without prompts as another window may have used it since the scans were checked, short scans are listed
+    def commit_scans(self):
+        date = datetime.now().strftime("%d/%m/%Y")
+        pending, self.scan_pending = self.scan_pending, {}
+        self.scan_reserved = {}
+
+        for batch_id, scans in pending.items():
+            if get_batch(batch_id) is None:
+                self.scan_error(batch_id, f"batch no longer exists, {len(scans)} scans were not added")
+                continue
+
+            steps = []
+            taken = {}  # ingredient id: weight earlier scans in this transaction take
+
+            for ingredient_id, amount in scans:
+                stock = ingredients[ingredient_id].weight if ingredient_id in ingredients else 0
+                available = stock - taken.get(ingredient_id, 0)
+
+                if amount > available:
+                    self.scan_error(f"{ingredient_id} {amount:g}", f"only {max(available, 0):g} left, not added")
+                    continue
+
+                taken[ingredient_id] = taken.get(ingredient_id, 0) + amount
+                steps.append((batch_id, "add_scanned", {"date": date, "ingredient_id": ingredient_id,
+                                                        "amount": amount}))
+
+            if not steps:
+                continue
+
+            if run_transaction(steps) is None:
+                self.scan_added += len(steps)
+            else:  # stock changed in another window since the scans were checked
+                self.scan_error(batch_id, f"{len(steps)} scans were not added, please rescan them")
+
+        if pending:
+            self.update_page(self.batch_id, self.batch_ids)
+
+        self.update_scan_label()
+
+    # line: the scanned text or batch id the error is about
+    def scan_error(self, line, reason):
+        self.scan_errors.insert(tk.END, f"{line}: {reason}")
+        self.scan_errors.see(tk.END)
+        self.scan_entry.bell()
+
+    def update_scan_label(self):
+        self.scan_label.config(text=f"{len(self.scan_queue)} queued, {self.scan_added} added")
 
+    def alter_batch(self, method_str):
         method_entries = self.method_entries[method_str]
 
         kwargs = {}
@@ -751,6 +3921,11 @@ class EditBatchPage(tk.Frame):
         for parameter in method_entries:
             kwargs[parameter] = method_entries[parameter].get()
 
+        if len(self.batch_ids) > 1:  # bulk mode, all batches or none
+            return bulk_apply(self.batch_ids, method_str, kwargs)
+
+        method_func = getattr(get_batch(self.batch_id, for_write=True), method_str)
+
         return method_func(**kwargs)
 
 
@@ -778,9 +3953,9 @@ class ScrollableBatchFunctions(tk.Canvas):
 
         # __________ Content Stuff __________
         self.batch_methods = [method for method in dir(Batch)  # get Batch methods
-                              if method[:2] != "__"  # not including  double underscore methods
-                              and method not in ["id_counter", "get_log"]  # and not including non-callable attributes
-                              ]                                            # or getter methods
+                              if method[:1] != "_"  # not including private or double underscore methods
+                              and method not in NON_PROCESS_ATTRIBUTES  # and not including non-callable attributes
+                              ]                                         # or getter and sync methods
 
         method_row = 2
         for method_str in self.batch_methods:
@@ -828,6 +4003,15 @@ class ScrollableBatchFunctions(tk.Canvas):
                                                )
                 ingredients_button.grid(row=1, column=3, sticky="e", padx=5)
 
+            elif method_str in TELEMETRY_STAGES:
+                probe_button = tk.Button(method_frame,
+                                         bg=LIGHT_ORANGE,
+                                         text="probe log",
+                                         padx=5,
+                                         command=lambda arg=method_str: self.import_probe_log(arg)
+                                         )
+                probe_button.grid(row=1, column=3, sticky="e", padx=5)
+
             parameter_entries = {}
             row = 2
             for parameter in parameters:
@@ -837,21 +4021,223 @@ class ScrollableBatchFunctions(tk.Canvas):
                 name_entry = tk.Entry(method_frame)
                 name_entry.grid(column=2, columnspan=3, row=row, pady=10, padx=10, sticky="ew")
 
-                parameter_entries[parameter] = name_entry
+                parameter_entries[parameter] = name_entry
+
+                row += 1
+
+            parent.method_entries[method_str] = parameter_entries
+
+            method_row += 1
+
+    def submit(self, method_str):
+        batch_count = len(batches)
+
+        e = self.parent.alter_batch(method_str)  # e variable checking for error
+        if not e == -1:
+            for widget in self.parent.method_entries[method_str].values():
+                widget.delete(0, tk.END)  # clear text from affected entries
+
+        if len(batches) != batch_count:  # a split created a new batch
+            self.parent.parent.refresh_batch_lists()
+
+        self.parent.update_page(self.parent.batch_id, self.parent.batch_ids)
+
+    def import_probe_log(self, stage):
+        if len(self.parent.batch_ids) > 1:
+            messagebox.showerror("Import Error", "Probe logs are imported for one batch at a time")
+            return -1
+
+        path = filedialog.askopenfilename(title=f"{stage} probe log", filetypes=[("CSV", "*.csv"), ("All", "*.*")])
+        if path:
+            import_probe_csv(self.parent.batch_id, stage, path)
+
+
+class DashboardPage(tk.Frame):  # live count of batches in each stage
+    def __init__(self, parent):
+        tk.Frame.__init__(self, parent, height=20, borderwidth=1, relief="solid")
+
+        self.parent = parent
+        self.shown_version = -1  # stage index version currently on screen
+        self.after_id = None
+
+        self.grid_columnconfigure(1, weight=1)
+        self.grid_rowconfigure(2, weight=1)
+
+        # __________ Page Title __________
+        title_frame = tk.Frame(self,
+                               bg=LIGHT_BLUE,
+                               height=50,
+                               width=50,
+                               borderwidth=1,
+                               relief="solid"
+                               )
+        title_frame.grid(row=1, column=1, padx=15, pady=10, sticky="we")
+
+        title_frame.grid_propagate(False)
+        title_frame.rowconfigure(1, weight=1)
+        title_frame.columnconfigure(1, weight=1)
+
+        title_label = tk.Label(title_frame,
+                               bg=LIGHT_BLUE,
+                               text="Work In Progress"
+                               )
+        title_label.grid(row=1, column=1)
+
+        # __________ Page Content __________
+        content_frame = tk.Frame(self, bg=DARK_BLUE, borderwidth=1, relief="solid")
+        content_frame.grid(row=2, column=1, sticky="new", pady=10, padx=10)
+
+        content_frame.columnconfigure(1, weight=1)
+
+        for column, heading in enumerate(["Stage", "Batches", "Weight"], start=1):
+            heading_label = tk.Label(content_frame, bg=LIGHT_ORANGE, text=heading)
+            heading_label.grid(row=1, column=column, sticky="we", padx=2, pady=(5, 2))
+
+        self.count_labels = []
+        self.weight_labels = []
+
+        # for loop control structure used to make one row per stage
+        for stage_row, stage in enumerate(STAGES, start=2):
+            stage_label = tk.Label(content_frame, bg=LIGHT_BLUE, text=stage, anchor="w")
+            stage_label.grid(row=stage_row, column=1, sticky="we", padx=2, pady=2)
+
+            count_label = tk.Label(content_frame, bg=LIGHT_BLUE, text="0", width=8)
+            count_label.grid(row=stage_row, column=2, padx=2, pady=2)
+            self.count_labels.append(count_label)
+
+            weight_label = tk.Label(content_frame, bg=LIGHT_BLUE, text="0", width=10)
+            weight_label.grid(row=stage_row, column=3, padx=2, pady=2)
+            self.weight_labels.append(weight_label)
+
+    def update_page(self):
+        if self.after_id is not None:  # only one refresh loop at a time
+            self.after_cancel(self.after_id)
+            self.after_id = None
+
+        if self.shown_version != stage_index.version:
+            self.shown_version = stage_index.version
+
+            for stage in range(len(STAGES)):
+                self.count_labels[stage].config(text=f"{stage_index.stage_counts[stage]}")
+                self.weight_labels[stage].config(text=f"{stage_index.stage_weights[stage]:g}")
+
+        if self.parent.current_page == DashboardPage:  # keep refreshing only while the page is shown
+            self.after_id = self.after(1000, self.update_page)
+
+
+class MassBalancePage(tk.Frame):  # batches whose mass balance does not add up
+    def __init__(self, parent):
+        tk.Frame.__init__(self, parent, height=20, borderwidth=1, relief="solid")
+
+        self.grid_columnconfigure(1, weight=1)
+        self.grid_rowconfigure(2, weight=1)
+
+        # __________ Page Title __________
+        title_frame = tk.Frame(self,
+                               bg=LIGHT_BLUE,
+                               height=50,
+                               width=50,
+                               borderwidth=1,
+                               relief="solid"
+                               )
+        title_frame.grid(row=1, column=1, padx=15, pady=10, sticky="we")
+
+        title_frame.grid_propagate(False)
+        title_frame.rowconfigure(1, weight=1)
+        title_frame.columnconfigure(1, weight=1)
+
+        self.title_label = tk.Label(title_frame,
+                                    bg=LIGHT_BLUE,
+                                    text="Yield Anomalies"
+                                    )
+        self.title_label.grid(row=1, column=1)
+
+        # __________ Page Content __________
+        self.report_text = tk.Text(self, bg=DARK_BLUE, font=("Courier", 8), wrap="word")
+        self.report_text.grid(row=2, column=1, sticky="nsew", pady=10, padx=10)
+
+    def update_page(self):
+        count, mean, std = mass_balance.fleet_stats()
+        flagged = mass_balance.flagged()
+
+        lines = [f"Fleet yield over last {count} batches: {mean:.1%}", ""]
+
+        for batch_id in sorted(flagged):  # only flagged batches, no log is read
+            balance = mass_balance.balances[batch_id]
+            lines.append(f"{batch_id}: {flagged[batch_id]}")
+            lines.append(f"    in {balance['input'] - balance['moved_out']:g}, lost {balance['loss']:g}, "
+                         f"out {balance['output']:g}")
+
+        if not flagged:
+            lines.append("No anomalous batches")
+
+        self.report_text.config(state="normal")
+        self.report_text.delete("1.0", tk.END)
+        self.report_text.insert(tk.END, "\n".join(lines))
+        self.report_text.config(state="disabled")
+
+
+class SchedulePage(tk.Frame):  # equipment bookings planned for batches still to be processed
+    def __init__(self, parent):
+        tk.Frame.__init__(self, parent, height=20, borderwidth=1, relief="solid")
+
+        self.grid_columnconfigure(1, weight=1)
+        self.grid_rowconfigure(2, weight=1)
+
+        # __________ Page Title __________
+        title_frame = tk.Frame(self,
+                               bg=LIGHT_BLUE,
+                               height=50,
+                               width=50,
+                               borderwidth=1,
+                               relief="solid"
+                               )
+        title_frame.grid(row=1, column=1, padx=15, pady=10, sticky="we")
+
+        title_frame.grid_propagate(False)
+        title_frame.rowconfigure(1, weight=1)
+        title_frame.columnconfigure(1, weight=1)
+
+        title_label = tk.Label(title_frame,
+                               bg=LIGHT_BLUE,
+                               text="Equipment Schedule"
+                               )
+        title_label.grid(row=1, column=1)
+
+        # __________ Page Content __________
+        self.report_text = tk.Text(self, bg=DARK_BLUE, font=("Courier", 8), wrap="none")
+        self.report_text.grid(row=2, column=1, sticky="nsew", pady=10, padx=10)
+
+    def update_page(self):
+        capacity_scheduler.load_equipment()
+        capacity_scheduler.ensure_plan()
+
+        lines = ["Planned days: " + ", ".join(f"{process} {capacity_scheduler.duration(process)}"
+                                              for process in SCHEDULED_PROCESSES)]
 
-                row += 1
+        for conflict in capacity_scheduler.conflicts:
+            lines.append(f"Double booked: {conflict}")
 
-            parent.method_entries[method_str] = parameter_entries
+        for batch_id in sorted(capacity_scheduler.unplaced):
+            lines.append(f"Not planned: {batch_id}, {capacity_scheduler.unplaced[batch_id]}")
 
-            method_row += 1
+        units = {}  # (process, unit name): bookings in start order
+        for booking in sorted(capacity_scheduler.bookings):
+            units.setdefault((booking[2], booking[3]), []).append(booking)
 
-    def submit(self, method_str):
-        e = self.parent.alter_batch(method_str)  # e variable checking for error
-        if not e == -1:
-            for widget in self.parent.method_entries[method_str].values():
-                widget.delete(0, tk.END)  # clear text from affected entries
+        for process in SCHEDULED_PROCESSES:
+            for name in capacity_scheduler.equipment[process]:
+                lines.append("")
+                lines.append(f"{name} ({process}, {capacity_scheduler.equipment[process][name]:g})")
+
+                for start, end, _, _, batch_id in units.get((process, name), []):
+                    lines.append(f"    {day_text(start)} - {day_text(end)}  {batch_id}  "
+                                 f"{stage_index.weight.get(batch_id, 0):g}")
 
-        self.parent.update_page(self.parent.batch_id)
+        self.report_text.config(state="normal")
+        self.report_text.delete("1.0", tk.END)
+        self.report_text.insert(tk.END, "\n".join(lines))
+        self.report_text.config(state="disabled")
 
 
 class ConsumerPage(tk.Frame):
@@ -887,6 +4273,15 @@ class ConsumerPage(tk.Frame):
                                   )
         search_button.grid(row=1, column=2, padx=(0, 20), pady=(10, 0), ipady=3)
 
+        logs_button = tk.Button(search_background,
+                                bg=LIGHT_ORANGE,
+                                text="Search logs",
+                                borderwidth=1,
+                                relief="ridge",
+                                command=lambda: self.open_log_search()
+                                )
+        logs_button.grid(row=1, column=3, padx=(0, 20), pady=(10, 0), ipady=3)
+
         content_frame = tk.Frame(self, bg=BLACK)  # black border frame
         content_frame.grid(row=2, column=1, sticky="nsew", padx=10, pady=(0, 20))
 
@@ -900,13 +4295,124 @@ class ConsumerPage(tk.Frame):
             messagebox.showerror("Existence Error", "Please enter batch id into the searchbar")
             return -1
 
-        if search_value not in batches:
+        if search_value not in batches and search_value not in cold_archive:
             messagebox.showinfo("Batch not found", "Batch id was not found, please check id is in format BAT-000")
             return -1
 
         self.parent.navigate(ViewBatchPage)
         self.parent.pages[ViewBatchPage].update_page(search_value)  # update page
 
+    def open_log_search(self):
+        self.parent.navigate(SearchPage)
+        self.parent.pages[SearchPage].update_page()
+
+
+SEARCH_RESULTS_SHOWN = 1000  # rows listed on the search page, the count still covers every match
+
+
+class SearchPage(tk.Frame):  # find batches by any value in their logs
+    def __init__(self, parent):
+        tk.Frame.__init__(self, parent, height=20, borderwidth=1, relief="solid")
+
+        self.parent = parent
+
+        self.grid_columnconfigure(1, weight=1)
+        self.grid_rowconfigure(3, weight=1)
+
+        # __________ Page Title __________
+        title_frame = tk.Frame(self,
+                               bg=LIGHT_BLUE,
+                               height=50,
+                               width=50,
+                               borderwidth=1,
+                               relief="solid"
+                               )
+        title_frame.grid(row=1, column=1, padx=15, pady=10, sticky="we")
+
+        title_frame.grid_propagate(False)
+        title_frame.rowconfigure(1, weight=1)
+        title_frame.columnconfigure(1, weight=1)
+
+        title_label = tk.Label(title_frame,
+                               bg=LIGHT_BLUE,
+                               text="Log Search"
+                               )
+        title_label.grid(row=1, column=1)
+
+        # __________ Query __________
+        query_frame = tk.Frame(self, bg=LIGHT_BLUE, borderwidth=1, relief="solid")
+        query_frame.grid(row=2, column=1, padx=15, sticky="we")
+
+        query_frame.columnconfigure(1, weight=1)
+
+        # words match any field, field:word, field>number, field<=number etc. match one field
+        self.query_entry = tk.Entry(query_frame)
+        self.query_entry.grid(row=1, column=1, padx=5, pady=5, sticky="we")
+        self.query_entry.bind("<Return>", lambda event: self.search())
+
+        search_button = tk.Button(query_frame,
+                                  bg=LIGHT_ORANGE,
+                                  text="Search",
+                                  padx=5,
+                                  command=lambda: self.search()
+                                  )
+        search_button.grid(row=1, column=2, padx=5)
+
+        self.result_label = tk.Label(query_frame, bg=LIGHT_BLUE, text="e.g. additive:banana temp>45", anchor="w")
+        self.result_label.grid(row=2, column=1, columnspan=2, padx=5, sticky="we")
+
+        # __________ Results __________
+        results_frame = tk.Frame(self, bg=BLACK)
+        results_frame.grid(row=3, column=1, sticky="nsew", pady=10, padx=10)
+
+        scroll_bar = ttk.Scrollbar(results_frame, orient="vertical")
+        scroll_bar.pack(side="right", fill="y")
+
+        # a listbox rather than a frame per row so thousands of matches list instantly
+        self.result_list = tk.Listbox(results_frame, bg=DARK_BLUE, yscrollcommand=scroll_bar.set)
+        self.result_list.pack(side="left", fill="both", expand=True, padx=3, pady=3)
+        self.result_list.bind("<Double-Button-1>", lambda event: self.open_result())
+
+        scroll_bar.config(command=self.result_list.yview)
+
+    def update_page(self):
+        self.query_entry.focus_set()
+
+    def search(self):
+        query = self.query_entry.get().strip()
+
+        if not query:
+            messagebox.showerror("Existence Error", "Please enter a search")
+            return -1
+
+        start = time.perf_counter()
+        try:
+            found = text_index.search(query)
+
+        except ValueError:
+            messagebox.showerror("Type Error", "A value compared with >, <, >=, <= or = must be a number")
+            return -1
+
+        keys = batch_order.keys["id"]
+        listed = heapq.nsmallest(SEARCH_RESULTS_SHOWN, found,  # in id order without sorting every match
+                                 key=lambda batch_id: (keys.get(batch_id, (2, 0, batch_id)), batch_id))
+        elapsed = (time.perf_counter() - start) * 1000
+
+        self.result_list.delete(0, tk.END)
+        self.result_list.insert(tk.END, *listed)
+
+        shown = f", first {SEARCH_RESULTS_SHOWN} listed" if len(found) > SEARCH_RESULTS_SHOWN else ""
+        self.result_label.config(text=f"{len(found)} batches in {elapsed:.1f} ms{shown}, double click to open")
+
+    def open_result(self):
+        selection = self.result_list.curselection()
+        if not selection:
+            return
+
+        batch_id = self.result_list.get(selection[0])
+        self.parent.navigate(ViewBatchPage)
+        self.parent.pages[ViewBatchPage].update_page(batch_id)
+
 
 class ViewBatchPage(tk.Frame):
     def __init__(self, parent):
@@ -937,11 +4443,35 @@ class ViewBatchPage(tk.Frame):
                                     )
         self.title_label.grid(row=1, column=1)
 
+        lineage_button = tk.Button(title_frame,
+                                   bg=LIGHT_ORANGE,
+                                   text="Lineage",
+                                   padx=5,
+                                   command=lambda: self.show_lineage()
+                                   )
+        lineage_button.grid(row=1, column=2, sticky="e", padx=5)
+
+        verify_button = tk.Button(title_frame,
+                                  bg=LIGHT_ORANGE,
+                                  text="Verify",
+                                  padx=5,
+                                  command=lambda: self.verify()
+                                  )
+        verify_button.grid(row=1, column=3, sticky="e", padx=5)
+
+        similar_button = tk.Button(title_frame,
+                                   bg=LIGHT_ORANGE,
+                                   text="Similar",
+                                   padx=5,
+                                   command=lambda: self.show_similar()
+                                   )
+        similar_button.grid(row=1, column=4, sticky="e", padx=5)
+
         # __________ Page Content __________
         content_frame = tk.Frame(self, bg=BLACK)
         content_frame.grid(row=2, column=1, sticky="nsew", pady=10, padx=10)
 
-        self.scroll_area = ScrollableBatchLView(content_frame)
+        self.scroll_area = ScrollableBatchLView(content_frame, parent)
         self.scroll_area.pack(expand=True, pady=3, padx=3)
 
     def update_page(self, instance_id):
@@ -950,11 +4480,51 @@ class ViewBatchPage(tk.Frame):
 
         self.scroll_area.update_page(instance_id)
 
+    def verify(self):  # check the log shown against the ledger with the same proof a consumer would use
+        proof = merkle_ledger.batch_proof(self.batch_id, get_batch(self.batch_id).get_log())
+
+        if proof is None:
+            messagebox.showinfo("Verification", "This batch has not been finalised")
+            return -1
+
+        if verify_batch_proof(proof):
+            messagebox.showinfo("Verification", f"All {len(proof['events'])} events match ledger root\n"
+                                                f"{proof['ledger_root']}")
+        else:
+            messagebox.showerror("Verification", "This batch log does not match its finalised merkle root")
+
+    def show_similar(self):  # batches with the closest process profile
+        if similarity_index is None:
+            messagebox.showerror("Import Error", "Similar batch search needs numpy to be installed")
+            return -1
+
+        results = similarity_index.similar(self.batch_id)
+
+        if not results:
+            messagebox.showinfo("Similar Batches", "This batch has no process readings to compare yet")
+            return -1
+
+        messagebox.showinfo("Similar Batches", "Batch          Distance\n"
+                                               "------------------------\n"
+                                               + "\n".join(f"{batch_id}:      {distance:.2f}"
+                                                           for batch_id, distance in results))
+
+    def show_lineage(self):
+        upstream = sorted(lineage.upstream(self.batch_id))
+        downstream = sorted(lineage.downstream(self.batch_id))
+        lots = sorted(lineage.ingredient_lots(self.batch_id))
+
+        messagebox.showinfo("Lineage", f"Made from batches: {', '.join(upstream) or 'none'}\n\n"
+                                       f"Ingredient lots: {', '.join(lots) or 'none'}\n\n"
+                                       f"Used in batches: {', '.join(downstream) or 'none'}")
+
 
 class ScrollableBatchLView(tk.Canvas):
-    def __init__(self, parent, **kwargs):
+    def __init__(self, parent, grandparent, **kwargs):
         super().__init__(parent, bg=DARK_BLUE, **kwargs)
 
+        self.grandparent = grandparent
+
         self.content = tk.Frame(self, bg=DARK_BLUE)  # main content area
 
         self.content.grid_columnconfigure(1, weight=1)
@@ -971,13 +4541,26 @@ class ScrollableBatchLView(tk.Canvas):
         self.content.bind("<Configure>", lambda event: self.configure(scrollregion=self.bbox("all")))
         self.bind("<Configure>", lambda event: self.itemconfig(self.window_id, width=event.width))
 
-    def update_page(self, instance_id):
-        for widget in self.content.winfo_children():  # clear content before reloading
+    def update_page(self, instance_id):  # rebuild is done in slices by the content scheduler
+        self.grandparent.scheduler.start(self, ViewBatchPage, self.build_page(instance_id),
+                                         lambda: self.update_page(instance_id))
+
+    def build_page(self, instance_id):
+        old_widgets = self.content.winfo_children()
+        log = list(get_batch(instance_id).get_log())  # copy so events added mid rebuild do not break iteration
+
+        total = len(old_widgets) + len(log)
+        done = 0
+
+        for widget in old_widgets:  # clear content before reloading
             widget.destroy()
+            done += 1
+            yield done, total
 
+        plotted = set()  # stages whose probe readings have already been drawn
         process_row = 1
-        for process in batches[instance_id].get_log():  # for every action taken in batch log
-            process = process.copy()
+        for record in log:  # for every action taken in batch log
+            stage, date_text, process = split_record(record)
             process_frame = tk.Frame(self.content,
                                      bg=LIGHT_BLUE,
                                      borderwidth=1,
@@ -989,26 +4572,17 @@ class ScrollableBatchLView(tk.Canvas):
 
             process_title = tk.Label(process_frame,
                                      bg=LIGHT_ORANGE,
-                                     text=process["process"]
+                                     text=stage
                                      )
             process_title.grid(row=1, column=1, columnspan=2, sticky="w")
-            del process["process"]
 
             date_label = tk.Label(process_frame,
                                   bg=LIGHT_ORANGE,
-                                  text="...",
+                                  text=date_text,
                                   padx=5,
                                   )
             date_label.grid(row=1, column=2, sticky="e", padx=5)
 
-            if "date" in process:
-                date_label.config(text=process["date"])
-                del process["date"]
-            else:
-                date_label.config(text=f"{process['start_dt']}-{process['end_dt']}")
-                del process["start_dt"]
-                del process["end_dt"]
-
             key_row = 2
             for key in process:
                 # load each action as label to show consumer
@@ -1020,7 +4594,18 @@ class ScrollableBatchLView(tk.Canvas):
 
                 key_row += 1
 
+            # plot the whole probe series once, at screen resolution, under the first event of its stage
+            if stage in TELEMETRY_STAGES and stage not in plotted and telemetry.has_series(instance_id, stage):
+                plotted.add(stage)
+                start, end = telemetry.time_range(instance_id, stage)
+
+                plot = tk.Canvas(process_frame, bg=LIGHT_BLUE, width=300, height=80, highlightthickness=0)
+                plot.grid(row=key_row, column=1, columnspan=2, pady=5)
+                draw_telemetry(plot, telemetry.downsample(instance_id, stage, start, end, 300), 80)
+
             process_row += 1
+            done += 1
+            yield done, total
 
 
 class ScrollableBatchList(tk.Canvas):
@@ -1031,10 +4616,58 @@ class ScrollableBatchList(tk.Canvas):
         self.parent = parent
         self.grandparent = grandparent
 
+        # page the list is shown on, used to cancel rebuilds when the user navigates away
+        self.page = WorkerPage if user_type == "worker" else ConsumerPage
+
+        self.filter_ids = None  # set of batch ids to show, None shows every batch
+        self.start = 0  # position of the first row shown in the current ordering
+        self.next_row = 1
+        self.selected = set()  # batch ids ticked for bulk editing, worker list only
+        self.check_vars = {}  # batch id: IntVar of its tick box, kept so the boxes stay ticked
+
         self.content = tk.Frame(self, bg=DARK_BLUE)  # main content area
 
         self.content.grid_columnconfigure(1, weight=1)
 
+        # __________ Sort And Page Controls __________
+        controls = tk.Frame(parent, bg=LIGHT_BLUE)
+        controls.pack(side="bottom", fill="x")  # packed first so it spans under the scrollbar too
+
+        self.sort_choice = ttk.Combobox(controls, state="readonly", width=10, values=SORT_ORDERS)
+        self.sort_choice.set("id")
+        self.sort_choice.bind("<<ComboboxSelected>>", lambda event: self.change_order())
+        self.sort_choice.pack(side="left", padx=5, pady=3)
+
+        self.reverse_var = tk.IntVar(value=0)
+        reverse_box = tk.Checkbutton(controls,
+                                     bg=LIGHT_BLUE,
+                                     text="reverse",
+                                     variable=self.reverse_var,
+                                     command=lambda: self.change_order()
+                                     )
+        reverse_box.pack(side="left")
+
+        next_button = tk.Button(controls,
+                                bg=LIGHT_ORANGE,
+                                text=">",
+                                padx=5,
+                                command=lambda: self.turn_page(1)
+                                )
+        next_button.pack(side="right", padx=5, pady=3)
+
+        self.page_label = tk.Label(controls, bg=LIGHT_BLUE, text="")
+        self.page_label.pack(side="right")
+
+        previous_button = tk.Button(controls,
+                                    bg=LIGHT_ORANGE,
+                                    text="<",
+                                    padx=5,
+                                    command=lambda: self.turn_page(-1)
+                                    )
+        previous_button.pack(side="right", padx=5, pady=3)
+
+        self.row_count = 0  # rows in the current ordering and filter
+
         # __________ Scrollbar Stuff __________
         scroll_bar = ttk.Scrollbar(parent, orient="vertical", command=self.yview)
         self.configure(yscrollcommand=scroll_bar.set)
@@ -1050,35 +4683,106 @@ class ScrollableBatchList(tk.Canvas):
         # __________ Content Stuff __________
         self.update_batch_list()
 
-    def update_batch_list(self):  # reload content in scrollbar
-        for widget in self.content.winfo_children():  # get all content children
+    def update_batch_list(self):  # reload content in scrollbar, in slices run by the content scheduler
+        self.grandparent.scheduler.start(self, self.page, self.build_batch_list(), self.update_batch_list)
+
+    def change_order(self):
+        self.start = 0
+        self.update_batch_list()
+
+    # step: 1 for the next page, -1 for the previous page
+    def turn_page(self, step):
+        start = self.start + step * BATCH_PAGE_SIZE
+
+        if 0 <= start < self.row_count:
+            self.start = start
+            self.update_batch_list()
+
+    def build_batch_list(self):
+        old_widgets = self.content.winfo_children()
+        order = self.sort_choice.get()
+        descending = bool(self.reverse_var.get())
+
+        # the orderings include archived batches, so the list and a date filter both reach the cold archive
+        if self.filter_ids is None:
+            self.row_count = len(batch_order.orders[order])
+        else:
+            filtered = batch_order.sorted_ids(order, self.filter_ids, descending)
+            self.row_count = len(filtered)
+            self.selected &= self.filter_ids  # ticks on rows hidden by a filter are dropped
+
+        if self.start >= self.row_count:  # the list shrank under the current page
+            self.start = max(self.row_count - 1, 0) // BATCH_PAGE_SIZE * BATCH_PAGE_SIZE
+
+        if self.filter_ids is None:
+            page_ids = batch_order.page(order, descending, self.start)
+        else:
+            page_ids = filtered[self.start:self.start + BATCH_PAGE_SIZE]
+
+        self.page_label.config(text=f"{self.start + 1 if page_ids else 0}-{self.start + len(page_ids)} "
+                                    f"of {self.row_count}")
+
+        total = len(old_widgets) + len(page_ids)
+        done = 0
+
+        for widget in old_widgets:  # get all content children
             widget.destroy()  # delete children
+            done += 1
+            yield done, total
+
+        self.check_vars = {}
+        self.next_row = 1
+        for batch_id in page_ids:  # one page of the chosen ordering
+            self.add_batch_row(batch_id)
+            done += 1
+            yield done, total
+
+    def add_batch_row(self, batch_id):
+        batch_frame = tk.Frame(self.content,
+                               bg=LIGHT_BLUE,
+                               borderwidth=1,
+                               relief="solid"
+                               )
+        batch_frame.grid(row=self.next_row, column=1, pady=10, sticky="we")
 
-        batch_row = 1
-        for batch in batches.values():  # for every saved batch (list of classes)
-            batch_frame = tk.Frame(self.content,
-                                   bg=LIGHT_BLUE,
-                                   borderwidth=1,
-                                   relief="solid"
-                                   )
-            batch_frame.grid(row=batch_row, column=1, pady=10, sticky="we")
+        batch_frame.columnconfigure(3, weight=1)
 
-            batch_frame.columnconfigure(3, weight=1)
+        batch_label = tk.Label(batch_frame,
+                               bg=LIGHT_ORANGE,
+                               text=batch_id
+                               )
+        batch_label.grid(row=1, column=1, columnspan=2, sticky="w")
 
-            batch_label = tk.Label(batch_frame,
-                                   bg=LIGHT_ORANGE,
-                                   text=batch.id
-                                   )
-            batch_label.grid(row=1, column=1, columnspan=2, sticky="w")
+        if self.user_type == "worker":
+            self.check_vars[batch_id] = tk.IntVar(value=batch_id in self.selected)
 
-            submit_button = tk.Button(batch_frame,
-                                      bg=LIGHT_ORANGE,
-                                      text=">",
-                                      padx=5,
-                                      command=lambda arg=batch.id: self.navigate_batch(arg)
-                                      )
-            submit_button.grid(row=1, column=4, sticky="e", padx=5)
-            batch_row += 1
+            select_box = tk.Checkbutton(batch_frame,
+                                        bg=LIGHT_BLUE,
+                                        variable=self.check_vars[batch_id],
+                                        command=lambda arg=batch_id: self.toggle_selected(arg)
+                                        )
+            select_box.grid(row=1, column=3, sticky="e")
+
+        submit_button = tk.Button(batch_frame,
+                                  bg=LIGHT_ORANGE,
+                                  text=">",
+                                  padx=5,
+                                  command=lambda arg=batch_id: self.navigate_batch(arg)
+                                  )
+        submit_button.grid(row=1, column=4, sticky="e", padx=5)
+
+        self.next_row += 1
+
+    def toggle_selected(self, batch_id):
+        if self.check_vars[batch_id].get():
+            self.selected.add(batch_id)
+        else:
+            self.selected.discard(batch_id)
+
+    # batch_ids: set of batch ids changed elsewhere, which can move in or out of the page shown
+    def patch_batches(self, batch_ids):
+        if self.filter_ids is None or batch_ids & self.filter_ids:
+            self.update_batch_list()  # only one page of rows is rebuilt
 
     def navigate_batch(self, batch_id):
 
@@ -1092,13 +4796,290 @@ class ScrollableBatchList(tk.Canvas):
             self.grandparent.pages[ViewBatchPage].update_page(batch_id)  # update page
 
 
+# -----------------------------------------------------------------------------
+# INSTRUMENTATION
+# -----------------------------------------------------------------------------
+# nothing below is wrapped or scheduled unless INSTRUMENT is set, so the normal app runs untouched
+
+SLOW_MS = 100  # operations taking longer than this (ms) are written to the slow log
+LAG_INTERVAL_MS = 100  # how often the mainloop lag probe is scheduled
+HISTOGRAM_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]  # bucket upper bounds in ms
+
+
+class LatencyMonitor:
+    # window_size: int, number of recent samples kept per operation for the rolling histogram
+    def __init__(self, window_size=500):
+        self.window_size = window_size
+        self.samples = {}  # operation name: deque of recent durations (ms)
+        self.counts = {}  # operation name: total number of calls
+        self.slow_log = collections.deque(maxlen=200)  # (time, operation, ms) of slow operations
+
+    # name: str, ms: float
+    def record(self, name, ms):
+        if name not in self.samples:
+            self.samples[name] = collections.deque(maxlen=self.window_size)
+            self.counts[name] = 0
+
+        self.samples[name].append(ms)
+        self.counts[name] += 1
+
+        if ms > SLOW_MS:
+            self.slow_log.append((datetime.now().strftime("%H:%M:%S"), name, ms))
+
+    # counts of recent samples in each bucket, last value counts samples above the largest bucket
+    def histogram(self, name):
+        counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for ms in self.samples.get(name, []):
+            bucket = 0
+            while bucket < len(HISTOGRAM_BUCKETS) and ms > HISTOGRAM_BUCKETS[bucket]:
+                bucket += 1
+            counts[bucket] += 1
+
+        return counts
+
+    # pct: float between 0 and 100
+    def percentile(self, name, pct):
+        ordered = sorted(self.samples.get(name, []))
+        if not ordered:
+            return 0
+
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def report(self):
+        lines = ["Operation                     calls     p50      p95      max (ms)",
+                 "-----------------------------------------------------------------"]
+
+        for name in sorted(self.samples):
+            recent = self.samples[name]
+            lines.append(f"{name:<28}{self.counts[name]:>7}{self.percentile(name, 50):>9.1f}"
+                         f"{self.percentile(name, 95):>9.1f}{max(recent):>9.1f}")
+
+        lines.append("")
+        lines.append("Histograms (ms <= " + ", ".join(str(bound) for bound in HISTOGRAM_BUCKETS) + ", more)")
+        for name in sorted(self.samples):
+            lines.append(f"{name:<28}" + " ".join(f"{count:>4}" for count in self.histogram(name)))
+
+        lines.append("")
+        lines.append(f"Slow operations (> {SLOW_MS} ms)")
+        for when, name, ms in self.slow_log:
+            lines.append(f"{when}  {name:<28}{ms:>9.1f}")
+
+        return "\n".join(lines)
+
+    # path: str
+    def dump(self, path=DIAGNOSTICS_FILE):
+        with open(path, "w") as file:
+            file.write(f"Cocoa Roots diagnostics {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n\n")
+            file.write(self.report())
+
+
+monitor = LatencyMonitor()
+
+
+# name: str, func: function to be timed
+def timed(name, func):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            monitor.record(name, (time.perf_counter() - start) * 1000)
+
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def instrument_app():
+    global save, load
+
+    # wrap the slow paths of the app in place, so instrumented and normal runs share the same code
+    for cls, method_str in [(Content, "navigate"), (Content, "switch_page"),
+                            (EditBatchPage, "alter_batch"), (EditBatchPage, "update_page"),
+                            (ViewBatchPage, "update_page"), (ScrollableBatchLView, "update_page"),
+                            (ScrollableBatchList, "update_batch_list")]:
+        setattr(cls, method_str, timed(f"{cls.__name__}.{method_str}", getattr(cls, method_str)))
+
+    save = timed("save", save)
+    load = timed("load", load)
+
+
+class LagProbe:
+    # measures how late Tk dispatches a callback scheduled with after(), which is time the mainloop was blocked
+    # widget: tk.Misc, interval: int (ms)
+    def __init__(self, widget, interval=LAG_INTERVAL_MS):
+        self.widget = widget
+        self.interval = interval
+        self.expected = 0
+
+    def start(self):
+        self.expected = time.perf_counter() + self.interval / 1000
+        self.widget.after(self.interval, self.tick)
+
+    def tick(self):
+        lag = (time.perf_counter() - self.expected) * 1000
+        monitor.record("mainloop lag", max(lag, 0))
+        self.start()
+
+
+class DiagnosticsPage(tk.Frame):
+    def __init__(self, parent):
+        tk.Frame.__init__(self, parent, height=20, borderwidth=1, relief="solid")
+
+        self.grid_rowconfigure(2, weight=1)
+        self.grid_columnconfigure(1, weight=1)
+
+        # __________ Page Title __________
+        title_frame = tk.Frame(self,
+                               bg=LIGHT_BLUE,
+                               height=50,
+                               width=50,
+                               borderwidth=1,
+                               relief="solid"
+                               )
+        title_frame.grid(row=1, column=1, padx=15, pady=10, sticky="we")
+
+        title_frame.grid_propagate(False)
+        title_frame.rowconfigure(1, weight=1)
+        title_frame.columnconfigure(1, weight=1)
+
+        title_label = tk.Label(title_frame,
+                               bg=LIGHT_BLUE,
+                               text="Diagnostics"
+                               )
+        title_label.grid(row=1, column=1)
+
+        refresh_button = tk.Button(title_frame,
+                                   bg=LIGHT_ORANGE,
+                                   text="Refresh",
+                                   padx=5,
+                                   command=lambda: self.update_page()
+                                   )
+        refresh_button.grid(row=1, column=2, sticky="e", padx=5)
+
+        dump_button = tk.Button(title_frame,
+                                bg=LIGHT_ORANGE,
+                                text="Dump",
+                                padx=5,
+                                command=lambda: self.dump()
+                                )
+        dump_button.grid(row=1, column=3, sticky="e", padx=5)
+
+        # __________ Page Content __________
+        self.report_text = tk.Text(self, bg=DARK_BLUE, font=("Courier", 8), wrap="none")
+        self.report_text.grid(row=2, column=1, sticky="nsew", pady=10, padx=10)
+
+    def update_page(self):
+        self.report_text.delete("1.0", tk.END)
+        self.report_text.insert(tk.END, monitor.report())
+
+    def dump(self):
+        monitor.dump()
+        messagebox.showinfo("Notification", f"Diagnostics written to {DIAGNOSTICS_FILE}")
+
+
+def show_diagnostics(content):
+    if content.current_page != DiagnosticsPage:
+        content.navigate(DiagnosticsPage)
+
+    content.pages[DiagnosticsPage].update_page()
+
+
+# -----------------------------------------------------------------------------
+# SELF CHECKS
+# -----------------------------------------------------------------------------
+# regression checks run with --self-check before any data is loaded, they only use in-memory batches and
+# temporary files so the saved data is never touched. Each returns True when it passes
+
+# several events on one batch in one transaction must each export their own record
+def check_transaction_export():
+    ingredient = Ingredient("Check lot", 10.0, "", "ING-CHK-001")
+    ingredients[ingredient.id] = ingredient
+    index_ingredient(ingredient, "")
+
+    batches["BAT-CHECK"] = Batch("BAT-CHECK")
+    index_batch(batches["BAT-CHECK"])
+
+    failed = run_transaction([("BAT-CHECK", "add_ingredient",
+                               {"date": "01/01/2024", "ingredient_id": ingredient.id, "amount": amount})
+                              for amount in [1, 2, 3]])
+
+    path = os.path.join(tempfile.mkdtemp(), "check.delta")
+    site_sync.export_delta(path)
+
+    with open(path, "rb") as file:
+        delta = json.loads(zlib.decompress(file.read()))
+
+    amounts = [entry["record"]["amount"] for entry in delta["entries"] if entry["kind"] == "event"]
+    return failed is None and amounts == [1.0, 2.0, 3.0]
+
+
+# a batch renamed on import goes back to its own site under its own id, and its proof still verifies here
+def check_sync_round_trip():
+    batches["BAT-001"] = Batch("BAT-001")  # takes the remote batch's id first, so the remote batch is renamed
+    index_batch(batches["BAT-001"])
+
+    remote_log = [{"process": "conching", "temperature": 50.0, "date": "01/01/2024"},
+                  {"process": "merge", "parent": f"{site_sync.site}:BAT-001", "amount": 0.0, "date": "01/01/2024"}]
+    remote_log.append({"process": "finalise", "verification_num": "1", "date": "02/01/2024",
+                       "merkle_root": merkle_root([event_hash(dict(record, parent="BAT-001") if "parent" in record
+                                                             else record) for record in remote_log])})
+
+    entries = [{"seq": 1, "kind": "batch", "id": "RMT:BAT-001"}]
+    entries += [{"seq": seq, "kind": "event", "batch": "RMT:BAT-001", "record": record}
+                for seq, record in enumerate(remote_log, 2)]
+
+    directory = tempfile.mkdtemp()
+    with open(os.path.join(directory, "in.delta"), "wb") as file:
+        file.write(zlib.compress(json.dumps({"format": DELTA_FORMAT, "site": "RMT", "from_seq": 1,
+                                             "to_seq": len(entries), "entries": entries}).encode()))
+
+    site_sync.import_delta(os.path.join(directory, "in.delta"))
+    renamed = site_sync.id_map[("RMT", "BAT-001")]
+    proof = merkle_ledger.batch_proof(renamed, get_batch(renamed).get_log())
+
+    batches[renamed].import_record({"process": "conching", "temperature": 45.0, "date": "03/01/2024"})
+    site_sync.export_delta(os.path.join(directory, "out.delta"))
+
+    with open(os.path.join(directory, "out.delta"), "rb") as file:
+        delta = json.loads(zlib.decompress(file.read()))
+
+    return (renamed != "BAT-001" and batches[renamed].get_log()[1]["parent"] == "BAT-001"
+            and proof is not None and verify_batch_proof(proof)
+            and [entry["batch"] for entry in delta["entries"] if entry["kind"] == "event"] == ["RMT:BAT-001"])
+
+
+SELF_CHECKS = [check_transaction_export, check_sync_round_trip]
+
+
 if __name__ == "__main__":
+    if "--benchmark" in sys.argv:  # print timings and exit without opening the window
+        benchmark_merkle()
+        sys.exit()
+
+    if "--self-check" in sys.argv:  # print each regression check result and exit without opening the window
+        for check in SELF_CHECKS:
+            print(f"{check.__name__}: {'ok' if check() else 'FAILED'}")
+        sys.exit()
+
+    if "--build-site" in sys.argv:  # nightly static site rebuild without opening the window
+        load()
+        written, unchanged, seconds = build_site()
+        print(f"{written} batch pages written, {unchanged} unchanged, in {seconds:.2f}s")
+        sys.exit()
+
+    if INSTRUMENT:
+        instrument_app()
+
     # call load function
     load()
 
     window = Window()
 
+    if INSTRUMENT:
+        LagProbe(window).start()
+        window.bind("<F12>", lambda event: show_diagnostics(window.content))  # open diagnostics panel
+
     # Call save function on closing tkinter window
-    window.protocol("WM_DELETE_WINDOW", lambda: save())
+    window.protocol("WM_DELETE_WINDOW", close)
 
     window.mainloop()